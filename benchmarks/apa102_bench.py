@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark APA102.show() against a fake SPI device.
+
+Reports frames per second and SPI calls per frame for a range of strip
+lengths, from the 12 pixel ring up to room sized strips. The legacy
+columns show the original transfer pattern for comparison: separate start
+frame, a copied list of the LED frames and one transfer per end frame byte.
+Use --latency to give every SPI transfer a simulated ioctl cost.
+"""
+import os
+import sys
+import time
+import argparse
+
+import fakes
+
+fakes.install()
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "terminator"))
+import apa102  # noqa: E402
+
+LED_COUNTS = [12, 60, 144, 300, 1024, 2048, 4096, 8192]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--leds", type=int, nargs="+", default=LED_COUNTS, help="Strip lengths."
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=1.0,
+        help="Seconds to run each strip length.",
+    )
+    parser.add_argument(
+        "-l",
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Simulated latency of one SPI transfer in microseconds.",
+    )
+    return parser.parse_args()
+
+
+def legacy_show(strip):
+    strip.spi.xfer2([0] * 4)
+    leds = list(strip.leds)
+    for start in range(0, len(leds), strip.bufsize):
+        strip.spi.xfer2(leds[start : start + strip.bufsize])
+    for _ in range((strip.num_led + 15) // 16):
+        strip.spi.xfer2([0x00])
+
+
+def bench_show(num_led, duration, show=apa102.APA102.show):
+    strip = apa102.APA102(num_led=num_led)
+    for led in range(num_led):
+        strip.set_pixel(led, led % 256, 0, 255 - led % 256)
+
+    frames = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        show(strip)
+        frames += 1
+    elapsed = time.perf_counter() - start
+    return frames / elapsed, strip.spi.calls / frames
+
+
+def main():
+    args = get_args()
+    fakes.FakeSpiDev.call_latency = args.latency / 1e6
+
+    print(
+        f"{'leds':>6} {'frames/s':>10} {'us/frame':>10} {'calls/frame':>12}"
+        f" {'legacy us/frame':>16} {'legacy calls':>13}"
+    )
+    for num_led in args.leds:
+        fps, calls = bench_show(num_led, args.duration)
+        legacy_fps, legacy_calls = bench_show(num_led, args.duration, legacy_show)
+        print(
+            f"{num_led:>6} {fps:>10.0f} {1e6 / fps:>10.1f} {calls:>12.1f}"
+            f" {1e6 / legacy_fps:>16.1f} {legacy_calls:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Run socketctl's MQTT bridge against the fake broker.
+
+Publishes bursts of random socket commands, --burst messages at a time
+with --pause seconds between bursts, and counts how many codes the fake
+transmitter had to send. Between bursts a random command is sent like a
+daemon command would be, which the bridge has to take into account. At
+the end the retained state of every socket has to match the last command
+it got.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import fakes
+
+fakes.install()
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import socketctl  # noqa: E402
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--bursts", type=int, default=50, help="Bursts to send.")
+    parser.add_argument("-b", "--burst", type=int, default=5, help="Messages a burst.")
+    parser.add_argument(
+        "-p", "--pause", type=float, default=0.2, help="Seconds between bursts."
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Show socketctl logging."
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.verbose:
+        socketctl.logging.basicConfig(level=socketctl.logging.INFO)
+    # Don't wait for the simulated airtime of every send
+    socketctl.airtime = lambda *args, **kwargs: 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socketctl.REPEATS_FILE = os.path.join(tmp, "repeats.json")
+
+        client = fakes.FakeMQTTClient()
+        bridge = socketctl.Bridge(client)
+        bridge.start()
+        client.connect(socketctl.MQTT_BROKER, socketctl.MQTT_PORT)
+
+        sender = fakes.FakeMQTTClient()
+        sender.connect(socketctl.MQTT_BROKER, socketctl.MQTT_PORT)
+        expected = {}
+        messages = 0
+        for _ in range(args.bursts):
+            for _ in range(args.burst):
+                target = random.choice([*socketctl.CODES, *socketctl.SCENES])
+                cmd = random.choice(list(socketctl.CMDS))
+                sender.publish(f"{socketctl.SOCKET_COMMAND_TOPIC}/{target}", cmd)
+                for socketnr in socketctl.SCENES.get(target, [target]):
+                    expected[socketnr] = cmd
+                messages += 1
+            time.sleep(args.pause)
+
+            # As "socketctl.py <cmd> <socket>" through the daemon
+            socketnr = random.choice(list(socketctl.CODES))
+            cmd = random.choice(list(socketctl.CMDS))
+            socketctl.socket_command(socketnr, cmd)
+            expected[socketnr] = cmd
+        time.sleep(10 * bridge.window)
+
+    rounds = socketctl.TX_ROUNDS
+    state = {
+        int(topic.rsplit("/", 1)[-1]): message.payload.decode()
+        for topic, message in fakes.broker.retained.items()
+        if topic.startswith(socketctl.SOCKET_STATE_TOPIC)
+    }
+    print(f"{messages} messages, {len(fakes.FakeRFDevice.sent) // rounds} codes sent")
+    print(f"{bridge.skipped} sends skipped, socket already in that state")
+    print(f"Retained state matches: {state == expected}")
+
+
+if __name__ == "__main__":
+    main()
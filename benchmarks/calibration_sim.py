@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Run socketctl's repeat calibration against simulated hardware.
+
+The fake transmitter echoes a code on the RF receive topic of the fake
+broker, the way esp-bme-rf does, if it was sent with at least the
+socket's simulated minimum number of repeats. The calibrated counts
+should match those minimums plus the calibration margin.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+import fakes
+
+fakes.install()
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import socketctl  # noqa: E402
+
+MINIMUM_REPEATS = {1: 4, 2: 6, 3: 2, 4: 10, 5: 3}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Show socketctl logging."
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.verbose:
+        socketctl.logging.basicConfig(level=socketctl.logging.INFO)
+
+    sockets = {
+        codes[cmd]: socketnr
+        for socketnr, codes in socketctl.CODES.items()
+        for cmd in socketctl.CMDS
+    }
+    echo = fakes.FakeMQTTClient()
+    echo.connect(socketctl.MQTT_BROKER, socketctl.MQTT_PORT)
+
+    def on_send(code, repeat):
+        if repeat >= MINIMUM_REPEATS[sockets[code]]:
+            echo.publish(socketctl.RF_RECEIVE_TOPIC, json.dumps({"decimal": code}))
+
+    fakes.FakeRFDevice.on_send = staticmethod(on_send)
+    # Don't wait for the simulated airtime of every send, echoes are instant
+    socketctl.airtime = lambda *args, **kwargs: 0
+    socketctl.CALIBRATION_SETTLE = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socketctl.REPEATS_FILE = os.path.join(tmp, "repeats.json")
+        repeats = socketctl.calibrate("on")
+
+    print(f"{'socket':>6} {'minimum':>8} {'calibrated':>11}")
+    for socketnr, repeat in repeats.items():
+        print(f"{socketnr:>6} {MINIMUM_REPEATS[socketnr]:>8} {repeat:>11}")
+
+
+if __name__ == "__main__":
+    main()
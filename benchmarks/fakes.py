@@ -0,0 +1,397 @@
+"""
+Fake hardware and network backends so the rpi-projects code can run on a
+desktop: spidev, gpiozero, rpi_rf, pyaudio and an in-process paho MQTT
+broker.
+
+install() registers the fakes in sys.modules under the names of the real
+modules. It has to be called before the modules under test are imported.
+"""
+
+import sys
+import time
+import types
+import ctypes
+import threading
+
+
+class FakeSpiDev:
+    """Stand-in for spidev.SpiDev that only counts what would be sent.
+
+    call_latency simulates the ioctl overhead of a single transfer in seconds.
+    """
+
+    call_latency = 0.0
+
+    def __init__(self):
+        self.max_speed_hz = 0
+        self.calls = 0
+        self.bytes_sent = 0
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def _transfer(self, data):
+        self.calls += 1
+        self.bytes_sent += len(data)
+        if self.call_latency:
+            time.sleep(self.call_latency)
+
+    def xfer2(self, data):
+        self._transfer(data)
+        data[:] = [0] * len(data)
+        return data
+
+    def writebytes2(self, data):
+        self._transfer(data)
+
+
+class FakeLED:
+    """Stand-in for gpiozero.LED."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.is_lit = False
+
+    def on(self):
+        self.is_lit = True
+
+    def off(self):
+        self.is_lit = False
+
+
+class FakeRFDevice:
+    """Stand-in for rpi_rf.RFDevice that records sent codes.
+
+    setup_latency simulates GPIO setup, tx_latency the airtime of one send.
+    """
+
+    setup_latency = 0.0
+    tx_latency = 0.0
+    sent = []
+    on_send = None  # Called with code and repeat count after every send
+
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self.tx_repeat = 10
+        if self.setup_latency:
+            time.sleep(self.setup_latency)
+
+    def enable_tx(self):
+        pass
+
+    def tx_code(self, code, tx_proto=None, tx_pulselength=None, tx_length=None):
+        self.sent.append((code, self.tx_repeat, tx_pulselength))
+        if self.tx_latency:
+            time.sleep(self.tx_latency)
+        if self.on_send:
+            self.on_send(code, self.tx_repeat)
+        return True
+
+    def cleanup(self):
+        pass
+
+
+class FakePorcupine:
+    """Stand-in for a pvporcupine handle that never detects a keyword.
+
+    process() converts the frame to a ctypes array like the real binding.
+    """
+
+    frame_length = 512
+    sample_rate = 16000
+
+    def process(self, pcm):
+        if len(pcm) != self.frame_length:
+            raise ValueError("Invalid frame length")
+        (ctypes.c_short * len(pcm))(*pcm)
+        return -1
+
+    def delete(self):
+        pass
+
+
+class FakeStream:
+    """Input stream in callback mode that plays FakePyAudio.source.
+
+    Frames are handed to the callback at speed times real time from a
+    thread, like PortAudio does. delivered maps id() of every frame to the
+    time.monotonic() it was handed over, so consumers can tell how long a
+    frame waited. finished is set once the source is played.
+    """
+
+    def __init__(self, source, rate, frames_per_buffer, stream_callback, speed):
+        self.source = source
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.callback = stream_callback
+        self.speed = speed
+        self.delivered = {}
+        self.finished = threading.Event()
+        self.running = threading.Event()
+        self.running.set()
+        self.thread = threading.Thread(target=self._play)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _play(self):
+        frame_time = self.frames_per_buffer / self.rate / (self.speed or float("inf"))
+        deadline = time.monotonic()
+        for frame in self.source:
+            if not self.running.is_set():
+                break
+            if len(frame) != 2 * self.frames_per_buffer:
+                raise ValueError("Source frames do not match frames_per_buffer")
+            deadline += frame_time
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.delivered[id(frame)] = time.monotonic()
+            self.callback(frame, self.frames_per_buffer, {}, 0)
+        self.finished.set()
+
+    def stop_stream(self):
+        self.running.clear()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def close(self):
+        self.stop_stream()
+
+
+class FakePyAudio:
+    """Stand-in for pyaudio.PyAudio that records from a list of frames.
+
+    Set source to the 16 bit mono frames to play and speed to the playback
+    speed, 1 being real time and 0 as fast as possible. streams holds every
+    opened stream.
+    """
+
+    source = []
+    speed = 1.0
+    streams = []
+
+    def open(
+        self,
+        format=None,
+        channels=1,
+        rate=16000,
+        frames_per_buffer=1024,
+        input=False,
+        stream_callback=None,
+        **kwargs,
+    ):
+        stream = FakeStream(
+            self.source, rate, frames_per_buffer, stream_callback, self.speed
+        )
+        self.streams.append(stream)
+        return stream
+
+    def terminate(self):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.payload = payload if payload is not None else b""
+        self.qos = qos
+        self.retain = retain
+
+
+class FakeMessageInfo:
+    def __init__(self, rc=0):
+        self.rc = rc
+        self.mid = 0
+
+    def is_published(self):
+        return self.rc == 0
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+class FakeBroker:
+    """In-process MQTT broker with retained messages and + / # wildcards.
+
+    Set online to False to simulate an outage: connects are refused and
+    connected clients are disconnected.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clients = []
+        self.retained = {}
+        self.published = []
+        self._online = True
+
+    @property
+    def online(self):
+        return self._online
+
+    @online.setter
+    def online(self, online):
+        self._online = online
+        if not online:
+            for client in list(self.clients):
+                client._lost()
+
+    @staticmethod
+    def matches(pattern, topic):
+        pattern, topic = pattern.split("/"), topic.split("/")
+        for i, level in enumerate(pattern):
+            if level == "#":
+                return True
+            if i >= len(topic) or (level != "+" and level != topic[i]):
+                return False
+        return len(pattern) == len(topic)
+
+    def publish(self, message):
+        with self.lock:
+            self.published.append(message)
+            if message.retain:
+                self.retained[message.topic] = message
+            clients = list(self.clients)
+        for client in clients:
+            client._deliver(message)
+
+    def subscribe(self, client, pattern):
+        with self.lock:
+            retained = [
+                message
+                for topic, message in self.retained.items()
+                if self.matches(pattern, topic)
+            ]
+        for message in retained:
+            client._deliver(message, pattern)
+
+
+broker = FakeBroker()
+
+
+class FakeMQTTClient:
+    """Stand-in for paho.mqtt.client.Client (1.x callback API) on the fake broker.
+
+    Messages are delivered synchronously in the publishing thread. Like
+    paho, qos>0 messages published while disconnected are kept and sent
+    after the next connect.
+    """
+
+    def __init__(self, client_id="", *args, **kwargs):
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.subscriptions = set()
+        self.connected = False
+        self.host = None
+        self.port = None
+        self.outbox = []
+        self.queue_size = 0
+
+    def connect(self, host, port=1883, keepalive=60):
+        self.host, self.port = host, port
+        if not broker.online:
+            raise ConnectionRefusedError(f"Fake broker {host}:{port} is down")
+        with broker.lock:
+            broker.clients.append(self)
+        self.connected = True
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+        outbox, self.outbox = self.outbox, []
+        for message in outbox:
+            broker.publish(message)
+        return 0
+
+    def max_queued_messages_set(self, queue_size):
+        self.queue_size = queue_size
+        return self
+
+    def connect_async(self, host, port=1883, keepalive=60):
+        self.host, self.port = host, port
+
+    def reconnect(self):
+        return self.connect(self.host, self.port)
+
+    def is_connected(self):
+        return self.connected
+
+    def loop_start(self):
+        if not self.connected and self.host is not None and broker.online:
+            self.connect(self.host, self.port)
+
+    def loop_stop(self, force=False):
+        pass
+
+    def disconnect(self):
+        if self.connected:
+            self._lost(rc=0)
+
+    def _lost(self, rc=1):
+        with broker.lock:
+            if self in broker.clients:
+                broker.clients.remove(self)
+        self.connected = False
+        if self.on_disconnect:
+            self.on_disconnect(self, None, rc)
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+        if self.connected:
+            broker.subscribe(self, topic)
+        return (0, 0)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.connected:
+            if qos == 0:
+                return FakeMessageInfo(rc=4)  # MQTT_ERR_NO_CONN
+            if self.queue_size and len(self.outbox) >= self.queue_size:
+                return FakeMessageInfo(rc=15)  # MQTT_ERR_QUEUE_SIZE
+            self.outbox.append(FakeMessage(topic, payload, qos, retain))
+            return FakeMessageInfo(rc=4)
+        broker.publish(FakeMessage(topic, payload, qos, retain))
+        return FakeMessageInfo()
+
+    def _deliver(self, message, pattern=None):
+        patterns = [pattern] if pattern else self.subscriptions
+        if self.on_message and any(broker.matches(p, message.topic) for p in patterns):
+            self.on_message(self, None, message)
+
+
+def install():
+    """Register the fake backends as importable modules."""
+
+    spidev = types.ModuleType("spidev")
+    spidev.SpiDev = FakeSpiDev
+    sys.modules["spidev"] = spidev
+
+    gpiozero = types.ModuleType("gpiozero")
+    gpiozero.LED = FakeLED
+    sys.modules["gpiozero"] = gpiozero
+
+    pyaudio = types.ModuleType("pyaudio")
+    pyaudio.PyAudio = FakePyAudio
+    pyaudio.paInt16 = 8
+    pyaudio.paContinue = 0
+    pyaudio.paInputOverflow = 2
+    sys.modules["pyaudio"] = pyaudio
+
+    rpi_rf = types.ModuleType("rpi_rf")
+    rpi_rf.RFDevice = FakeRFDevice
+    sys.modules["rpi_rf"] = rpi_rf
+
+    paho = types.ModuleType("paho")
+    paho.mqtt = types.ModuleType("paho.mqtt")
+    paho.mqtt.client = types.ModuleType("paho.mqtt.client")
+    paho.mqtt.client.Client = FakeMQTTClient
+    paho.mqtt.client.MQTTMessage = FakeMessage
+    paho.mqtt.client.MQTT_ERR_SUCCESS = 0
+    paho.mqtt.client.MQTT_ERR_NO_CONN = 4
+    sys.modules["paho"] = paho
+    sys.modules["paho.mqtt"] = paho.mqtt
+    sys.modules["paho.mqtt.client"] = paho.mqtt.client
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+CPU cost of the idle listening loop: framing audio for Porcupine.
+
+Feeds a 16 kHz mono 16 bit WAV (or generated noise) frame by frame to a
+fake Porcupine that converts frames the way the real binding does. The
+"struct" variant is the old struct.unpack_from path, "memoryview" the
+zero-copy memoryview.cast("h") path of AudioCapture.read_pcm. CPU% is
+the CPU time per frame relative to the 32 ms of audio in a frame, i.e.
+the load of the always-on loop at real time. The framing column is the
+cost of producing the frame alone, without the Porcupine call.
+"""
+import time
+import wave
+import random
+import struct
+import argparse
+
+import fakes
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("wav", nargs="?", help="Recorded 16 kHz mono 16 bit WAV.")
+    parser.add_argument(
+        "-s", "--seconds", type=float, default=60, help="Noise to generate."
+    )
+    return parser.parse_args()
+
+
+def load_frames(path, seconds, frame_length, rate):
+    if path:
+        with wave.open(path) as wav:
+            if wav.getframerate() != rate or wav.getnchannels() != 1:
+                raise SystemExit(f"{path} is not {rate} Hz mono.")
+            data = wav.readframes(wav.getnframes())
+    else:
+        count = int(seconds * rate)
+        data = struct.pack(
+            f"{count}h", *(random.randint(-300, 300) for _ in range(count))
+        )
+    size = 2 * frame_length
+    return [data[i : i + size] for i in range(0, len(data) - size + 1, size)]
+
+
+def struct_frames(frames, frame_length):
+    for pcm in frames:
+        yield struct.unpack_from("h" * frame_length, pcm)
+
+
+def memoryview_frames(frames, frame_length):
+    for pcm in frames:
+        yield memoryview(pcm).cast("h")
+
+
+def main():
+    args = get_args()
+    porcupine = fakes.FakePorcupine()
+    frames = load_frames(
+        args.wav, args.seconds, porcupine.frame_length, porcupine.sample_rate
+    )
+    frame_time = porcupine.frame_length / porcupine.sample_rate
+
+    print(f"{len(frames)} frames, {len(frames) * frame_time:.1f}s of audio")
+    print(f"{'variant':>10} {'framing us':>11} {'us/frame':>9} {'CPU %':>6}")
+    for name, framing in [("struct", struct_frames), ("memoryview", memoryview_frames)]:
+        start = time.process_time()
+        for pcm in framing(frames, porcupine.frame_length):
+            pass
+        framing_time = (time.process_time() - start) / len(frames)
+
+        start = time.process_time()
+        for pcm in framing(frames, porcupine.frame_length):
+            porcupine.process(pcm)
+        per_frame = (time.process_time() - start) / len(frames)
+        print(
+            f"{name:>10} {framing_time * 1e6:>11.1f} {per_frame * 1e6:>9.1f}"
+            f" {100 * per_frame / frame_time:>6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Replay recorded audio through the assistant and time every stage.
+
+The WAV files (16 kHz mono 16 bit) are played by the fake PyAudio from
+fakes.py at --speed times real time, with --gap seconds of silence after
+each, into the same AudioCapture, get_keyword_blocking,
+get_command_blocking and dispatch code the assistant runs. Porcupine and
+vosk are the real engines. The LED ring, GPIO and RF transmitter are
+fakes, MQTT goes to the fake broker and socket commands to an in-process
+socketctl daemon.
+
+Stages:
+  wake        keyword frame captured to keyword detected
+  first word  keyword detected to the first partial result
+  recognize   last word to command returned
+  match       intent match of the command
+  rf send     socketctl call, daemon round trip and RF airtime
+  publish     MQTT publish
+CPU is the process CPU time relative to the length of the audio, so it is
+the load at real time. RSS is the peak resident set size.
+"""
+import os
+import sys
+import time
+import wave
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import statistics
+from collections import defaultdict
+
+try:
+    import queue as Queue
+except ImportError:
+    import Queue as Queue
+
+import fakes
+
+fakes.install()
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "terminator"))
+import socketctl  # noqa: E402
+import assistant  # noqa: E402
+
+STAGES = ["wake", "first word", "recognize", "match", "rf send", "publish"]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("wav", nargs="+", help="Recorded 16 kHz mono 16 bit WAVs.")
+    parser.add_argument("-m", "--model", required=True, help="Vosk model folder.")
+    parser.add_argument(
+        "-s",
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Playback speed, 1 is real time and 0 as fast as possible.",
+    )
+    parser.add_argument(
+        "-g", "--gap", type=float, default=1.5, help="Silence after every WAV."
+    )
+    parser.add_argument(
+        "-a",
+        "--airtime",
+        type=float,
+        default=socketctl.airtime(),
+        help="Seconds per RF send, default the modelled airtime.",
+    )
+    parser.add_argument(
+        "-e",
+        "--early-dispatch",
+        action="store_true",
+        help="Run commands as soon as the partial result is a complete command.",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Show the assistant log."
+    )
+    return parser.parse_args()
+
+
+def load_frames(paths, gap, frame_length, rate):
+    """Returns the WAVs as one list of frames and their length in seconds."""
+    size = 2 * frame_length
+    frames = []
+    for path in paths:
+        with wave.open(path) as wav:
+            if (
+                wav.getframerate() != rate
+                or wav.getnchannels() != 1
+                or wav.getsampwidth() != 2
+            ):
+                raise SystemExit(f"{path} is not {rate} Hz mono 16 bit.")
+            data = wav.readframes(wav.getnframes())
+        data += bytes(-len(data) % size)
+        frames.extend(data[i : i + size] for i in range(0, len(data), size))
+        # Every frame a new object, so they can be told apart by id()
+        frames.extend(bytes(size) for _ in range(int(gap * rate / frame_length)))
+    return frames, len(frames) * frame_length / rate
+
+
+def timed(stages, name, func):
+    def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stages[name].append(time.monotonic() - start)
+
+    return wrapper
+
+
+def instrument(stages, porcupine, capture, client):
+    """Wraps the assistant stages to record their latencies."""
+    stream = capture.stream
+    process = porcupine.process
+
+    def timed_process(pcm):
+        result = process(pcm)
+        if result >= 0:
+            stages["wake"].append(time.monotonic() - stream.delivered[id(pcm.obj)])
+        return result
+
+    porcupine.process = timed_process
+
+    get_command_blocking = assistant.get_command_blocking
+
+    def timed_get_command_blocking(recognizer, capture, *args):
+        capture.first_word_latency = None
+        capture.command_latency = None
+        command = get_command_blocking(recognizer, capture, *args)
+        if capture.first_word_latency is not None:
+            stages["first word"].append(capture.first_word_latency)
+        if capture.command_latency is not None:
+            stages["recognize"].append(capture.command_latency)
+        return command
+
+    assistant.get_command_blocking = timed_get_command_blocking
+    assistant.GRAMMAR.match = timed(stages, "match", assistant.GRAMMAR.match)
+    assistant.socketctl = timed(stages, "rf send", assistant.socketctl)
+    client.publish = timed(stages, "publish", client.publish)
+
+
+def start_socketctl(path):
+    thread = threading.Thread(target=socketctl.serve, args=(path,))
+    thread.daemon = True
+    thread.start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    assistant.SOCKETCTL_SOCKET = path
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    fakes.FakeRFDevice.tx_latency = args.airtime
+
+    # Same keywords as assistant.main
+    porcupine = assistant.pvporcupine.create(keywords=["terminator", "blueberry"])
+    recognizer = assistant.load_recognizer(args.model)
+    frames, seconds = load_frames(
+        args.wav, args.gap, porcupine.frame_length, porcupine.sample_rate
+    )
+    fakes.FakePyAudio.source = frames
+    fakes.FakePyAudio.speed = args.speed
+
+    client = assistant.mqtt.Client()
+    client.on_connect = assistant.on_mqtt_connect
+    client.connect("localhost")
+
+    stages = defaultdict(list)
+    recognized = []
+    with tempfile.TemporaryDirectory() as tmp:
+        start_socketctl(os.path.join(tmp, "socketctl.sock"))
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.monotonic()
+        capture = assistant.AudioCapture(
+            fakes.FakePyAudio(), porcupine.sample_rate, porcupine.frame_length
+        )
+        instrument(stages, porcupine, capture, client)
+        commands = Queue.Queue()
+        worker = threading.Thread(
+            target=assistant.recognize,
+            args=(porcupine, recognizer, capture, commands, args.early_dispatch),
+        )
+        worker.daemon = True
+        worker.start()
+
+        # The worker recognizes what is still queued after the end marker
+        while worker.is_alive() or not commands.empty():
+            if capture.stream.finished.is_set() and not capture.closed:
+                capture.close()
+            try:
+                command = commands.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+            recognized.append(command)
+            assistant.dispatch(command, client)
+        elapsed = time.monotonic() - start
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    porcupine.delete()
+
+    cpu = (end_usage.ru_utime + end_usage.ru_stime) - (usage.ru_utime + usage.ru_stime)
+    print(
+        f"{seconds:.1f}s of audio played in {elapsed:.1f}s,"
+        f" {len(recognized)} commands: {recognized}"
+    )
+    print(f"{'stage':>10} {'count':>6} {'median ms':>10} {'max ms':>8}")
+    for name in STAGES:
+        times = stages[name]
+        if times:
+            print(
+                f"{name:>10} {len(times):>6} {statistics.median(times) * 1e3:>10.2f}"
+                f" {max(times) * 1e3:>8.2f}"
+            )
+        else:
+            print(f"{name:>10} {0:>6} {'-':>10} {'-':>8}")
+    print(
+        f"CPU {100 * cpu / seconds:.1f}% at real time,"
+        f" peak RSS {end_usage.ru_maxrss / 1024:.1f} MB"
+    )
+    print(f"Capture: {capture.stats()}, LEDs: {assistant.pixels.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Compare command to RF latency of forking socketctl.py with the daemon.
+
+The fork column runs "socketctl.py on <socket>" as a new process for
+every command, the way the assistant used to. The daemon column sends
+the same command to a running "socketctl.py --serve". Both use the fake
+rpi_rf from fakes.py, so the real GPIO and RPi.GPIO import costs come on
+top of the fork numbers on a Pi.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+import fakes
+
+fakes.install()
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import socketctl  # noqa: E402
+
+# Runs socketctl.py with the fake backends installed
+RUNNER = (
+    "import sys, runpy; sys.path.insert(0, {benchmarks!r}); import fakes;"
+    " fakes.install(); sys.argv[0] = {script!r};"
+    " runpy.run_path({script!r}, run_name='__main__')"
+).format(
+    benchmarks=os.path.dirname(os.path.abspath(__file__)),
+    script=os.path.join(ROOT, "socketctl.py"),
+)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--count", type=int, default=20, help="Commands per variant."
+    )
+    parser.add_argument("--socket", type=int, default=3, help="Socket to switch.")
+    return parser.parse_args()
+
+
+def socketctl_cmd(*args):
+    return [sys.executable, "-c", RUNNER, *args]
+
+
+def bench_fork(count, socketnr, socket_path):
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        subprocess.run(
+            socketctl_cmd("--socket-path", socket_path, "on", str(socketnr)),
+            check=True,
+        )
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_daemon(count, socketnr, socket_path):
+    daemon = subprocess.Popen(socketctl_cmd("--serve", "--socket-path", socket_path))
+    try:
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+        times = []
+        for _ in range(count):
+            start = time.perf_counter()
+            assert socketctl.daemon_command(socketnr, "on", socket_path)
+            times.append(time.perf_counter() - start)
+        return times
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+
+def main():
+    args = get_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "socketctl.sock")
+        results = {
+            "fork": bench_fork(args.count, args.socket, socket_path),
+            "daemon": bench_daemon(args.count, args.socket, socket_path),
+        }
+
+    print(f"{'variant':>8} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for name, times in results.items():
+        print(
+            f"{name:>8} {statistics.median(times) * 1e3:>10.2f}"
+            f" {min(times) * 1e3:>8.2f} {max(times) * 1e3:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
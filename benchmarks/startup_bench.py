@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Startup time of socketctl.py.
+
+The import table is the "python -X importtime" breakdown of importing
+socketctl, median over all runs and sorted by the time spent in the
+module itself. The command table times whole socketctl.py processes with
+the fakes from fakes.py installed. The fakes load instantly, so on a Pi
+the GPIO setup of rpi_rf comes on top of the "on" and decimal rows, but
+not of the import table: rpi_rf is only imported when a code is sent.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+from collections import defaultdict
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS, "..")
+SCRIPT = os.path.join(ROOT, "socketctl.py")
+
+# Runs socketctl.py with the fake backends installed
+RUNNER = (
+    "import sys, runpy; sys.path.insert(0, {benchmarks!r}); import fakes;"
+    " fakes.install(); sys.argv[0] = {script!r};"
+    " runpy.run_path({script!r}, run_name='__main__')"
+).format(benchmarks=BENCHMARKS, script=SCRIPT)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--count", type=int, default=20, help="Runs per row.")
+    parser.add_argument(
+        "-t", "--top", type=int, default=15, help="Modules in the import table."
+    )
+    return parser.parse_args()
+
+
+def import_times(count):
+    """Returns {module: [(self us, cumulative us), ...]} of importing socketctl."""
+    times = defaultdict(list)
+    for _ in range(count):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import socketctl"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            own, cumulative, module = line[len("import time:") :].split("|")
+            times[module.strip()].append((int(own), int(cumulative)))
+    return times
+
+
+def run_times(count, args):
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    args = get_args()
+
+    times = import_times(args.count)
+    rows = sorted(
+        (
+            (
+                statistics.median(own for own, _ in runs),
+                statistics.median(cumulative for _, cumulative in runs),
+                module,
+            )
+            for module, runs in times.items()
+        ),
+        reverse=True,
+    )
+    total = statistics.median(cumulative for _, cumulative in times["socketctl"])
+    print(f"import socketctl: {total / 1e3:.2f} ms")
+    print(f"{'module':>20} {'self ms':>8} {'cumulative ms':>14}")
+    for own, cumulative, module in rows[: args.top]:
+        print(f"{module:>20} {own / 1e3:>8.2f} {cumulative / 1e3:>14.2f}")
+    print()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # No daemon listens here, so the argparse row sends directly. The
+        # fast path has no options and uses the default daemon socket.
+        socket_path = os.path.join(tmp, "socketctl.sock")
+        rows = {
+            "python": ["-c", "pass"],
+            "fakes": ["-c", RUNNER.split(" sys.argv")[0]],
+            "dry run": ["-c", RUNNER, "-n", "on", "3"],
+            "on": ["-c", RUNNER, "on", "3"],
+            "decimal": ["-c", RUNNER, "1135697"],
+            "argparse": ["-c", RUNNER, "--socket-path", socket_path, "on", "3"],
+        }
+        print(f"{'command':>10} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+        for name, command in rows.items():
+            times = run_times(args.count, command)
+            print(
+                f"{name:>10} {statistics.median(times) * 1e3:>10.2f}"
+                f" {min(times) * 1e3:>8.2f} {max(times) * 1e3:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import json
 import time
+import queue
+import atexit
+import socket
 import logging
-import argparse
-import subprocess
+import threading
+import socketserver
 
-from rpi_rf import RFDevice
+# rpi_rf (and RPi.GPIO through it) and argparse are imported where they are
+# needed, so plain "socketctl.py <cmd> <socket>" calls start fast
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +25,438 @@ CODES = {
     5: {"name": "server", "on": 1135937, "off": 1135940},
 }
 CMDS = {"on": "1", "off": "0"}
-SEND_PATH = "/home/pi/utils/433Utils/RPi_utils/send"
+SCENES = {"all": list(CODES)}
+TX_REPEAT = 20
+TX_ROUNDS = 2  # Every code is sent this many times, interleaved with the others
+TX_PULSELENGTH = 500
+TX_CODE_LENGTH = 24
+SERVICE_SOCKET = "/tmp/socketctl.sock"
+DAEMON_TIMEOUT = 10  # Seconds to wait for the daemon on top of the airtime
+REPEATS_FILE = os.path.expanduser("~/.config/socketctl.json")
+MQTT_BROKER = "localhost"
+MQTT_PORT = 8883
+RF_RECEIVE_TOPIC = "room/data/rf/recieve"  # RF codes echoed by esp-bme-rf
+CALIBRATION_REPEATS = [20, 15, 12, 10, 8, 6, 5, 4, 3, 2, 1]
+CALIBRATION_TRIALS = 3
+CALIBRATION_MARGIN = 2  # Repeats added to the lowest count that was received
+CALIBRATION_SETTLE = 1  # Seconds for late echoes of a send to arrive
+SOCKET_COMMAND_TOPIC = "room/control/command/socket"
+SOCKET_STATE_TOPIC = "room/data/socket"
+BRIDGE_WINDOW = 0.05  # Seconds to wait for more commands before sending
+
+transmitter = None
+
+
+class Transmitter:
+    """433 MHz transmitter that owns its GPIO pin for the process lifetime.
+
+    The pin is set up on the first send and only released by close().
+    Sends from several threads are serialized with a lock.
+    """
+
+    def __init__(self, gpio=GPIO_PIN):
+        self.gpio = gpio
+        self.lock = threading.RLock()
+        self.rf_device = None
+
+    def open(self):
+        with self.lock:
+            if self.rf_device is None:
+                from rpi_rf import RFDevice
+
+                logger.debug(f"Setting up rpi_rf transmitter on GPIO {self.gpio}.")
+                self.rf_device = RFDevice(self.gpio)
+                self.rf_device.enable_tx()
+
+    def send(self, code, repeat=TX_REPEAT, pulselength=TX_PULSELENGTH):
+        with self.lock:
+            try:
+                self.open()
+                self.rf_device.tx_repeat = repeat
+                self.rf_device.tx_code(code, tx_pulselength=pulselength)
+            except:
+                logger.exception("Error while sending code to socket using rpi_rf")
+                # Start over with a fresh device on the next send
+                self.close()
+                return False
+            return True
+
+    def close(self):
+        with self.lock:
+            if self.rf_device is not None:
+                self.rf_device.cleanup()
+                self.rf_device = None
+
+
+def airtime(repeat=TX_REPEAT, pulselength=TX_PULSELENGTH, length=TX_CODE_LENGTH):
+    """Seconds one rpi_rf send of a code occupies the band.
+
+    With rpi_rf protocol 1 every bit is 4 pulses long and every repeat ends
+    with a 32 pulse sync.
+    """
+    return repeat * (length * 4 + 32) * pulselength / 1e6
+
+
+def load_repeats(path=None):
+    """Returns the calibrated {socket: repeat count} dict, see calibrate()."""
+    path = path or REPEATS_FILE
+    try:
+        with open(path) as f:
+            return {int(socketnr): repeat for socketnr, repeat in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, AttributeError):
+        logger.warning(f"Ignoring broken repeat calibration in {path}.")
+        return {}
+
+
+def save_repeats(repeats, path=None):
+    path = path or REPEATS_FILE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({str(socketnr): repeat for socketnr, repeat in repeats.items()}, f)
+
+
+class SocketStates:
+    """Last state every socket was switched to by this process.
+
+    TxQueue updates it after every send, so the daemon, its batches and
+    the bridge share one table. Decimal codes of a socket count as well. A
+    failed send makes the state unknown. on_change is called with socket
+    and cmd after every successful send.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+        self.on_change = None
+        self.codes = {
+            codes[cmd]: (socketnr, cmd)
+            for socketnr, codes in CODES.items()
+            for cmd in CMDS
+        }
+
+    def get(self, socketnr):
+        with self.lock:
+            return self.states.get(socketnr)
+
+    def update(self, pending, results):
+        """Takes TxQueue's pending codes and the results of sending them."""
+        for key, ok in results.items():
+            if pending[key] not in self.codes:
+                continue
+            socketnr, cmd = self.codes[pending[key]]
+            with self.lock:
+                if ok:
+                    self.states[socketnr] = cmd
+                else:
+                    self.states.pop(socketnr, None)
+            if ok and self.on_change:
+                self.on_change(socketnr, cmd)
+
+
+socket_states = SocketStates()
+
+
+class TxQueue:
+    """Collects socket commands and sends them as one batch.
+
+    Only the latest command per socket is kept, so on followed by off
+    just sends off, and the same decimal code is only sent once. flush()
+    sends every code TX_ROUNDS times, but round robin instead of all
+    repeats of one socket before the next. Every socket gets its first
+    burst as early as possible and the bursts of one code are spread out
+    in time, as the back to back double send did before.
+
+    Sockets are sent with their calibrated repeat count (see calibrate()),
+    everything else with repeat.
+    """
+
+    def __init__(
+        self,
+        transmitter=None,
+        repeat=TX_REPEAT,
+        rounds=TX_ROUNDS,
+        pulselength=TX_PULSELENGTH,
+        repeats=None,
+    ):
+        self.transmitter = transmitter
+        self.repeat = repeat
+        self.repeats = load_repeats() if repeats is None else repeats
+        self.rounds = rounds
+        self.pulselength = pulselength
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, socketnr, cmd):
+        """Queues a command for a socket or scene, or a decimal code.
+
+        Returns the keys of the queued codes in pending, an empty list if
+        the command is invalid.
+        """
+        if not cmd.isnumeric() and cmd not in CMDS:
+            logger.error("Invalid command! Use either [on|off] or an integer number.")
+            return []
+
+        if cmd.isnumeric():
+            logger.info("Queue decimal code {}.".format(cmd))
+            self.put(cmd, int(cmd))
+            return [cmd]
+
+        if socketnr in SCENES:
+            logger.info("Queue command {} to scene {}.".format(cmd, socketnr))
+            for scene_socket in SCENES[socketnr]:
+                self.put(scene_socket, CODES[scene_socket][cmd])
+            return list(SCENES[socketnr])
+
+        if socketnr not in CODES.keys():
+            logger.warning(
+                "Bad Socketnumber {}. Use one of {}.".format(socketnr, CODES.keys())
+            )
+            return []
+
+        logger.info("Queue command {} to socket {}.".format(cmd, socketnr))
+        self.put(socketnr, CODES[socketnr][cmd])
+        return [socketnr]
+
+    def put(self, key, code):
+        # A newer command for the same socket replaces the pending one
+        self.pending.pop(key, None)
+        self.pending[key] = code
+
+    def airtime(self):
+        """Expected seconds on air for sending all pending codes."""
+        return self.rounds * sum(
+            airtime(self.repeats.get(key, self.repeat), self.pulselength)
+            for key in self.pending
+        )
+
+    def flush(self, dry_run=False):
+        """Sends all pending codes and returns a {socket or code: success} dict.
+
+        With dry_run nothing is sent and only the expected airtime is logged.
+        """
+        logger.info(
+            "Sending {} codes in {} rounds, {:.2f}s airtime.".format(
+                len(self.pending), self.rounds, self.airtime()
+            )
+        )
+        pending, self.pending = self.pending, {}
+        results = {key: True for key in pending}
+        if dry_run:
+            return results
+
+        transmitter = self.transmitter or get_transmitter()
+        for _ in range(self.rounds):
+            for key, code in pending.items():
+                repeat = self.repeats.get(key, self.repeat)
+                logger.debug(
+                    "Sending code {} for {} using rpi_rf ({} repeats)".format(
+                        code, key, repeat
+                    )
+                )
+                results[key] &= transmitter.send(code, repeat, self.pulselength)
+        socket_states.update(pending, results)
+        return results
+
+
+def calibrate(cmd, sockets=None, broker=MQTT_BROKER, port=MQTT_PORT):
+    """Finds the lowest reliable repeat count for every socket.
+
+    Each socket's cmd code is sent with decreasing repeat counts until the
+    esp-bme-rf receiver misses one of CALIBRATION_TRIALS sends. The receiver
+    publishes every code it hears on RF_RECEIVE_TOPIC. The lowest count
+    that always came through plus CALIBRATION_MARGIN is stored in
+    REPEATS_FILE and used by TxQueue from then on.
+    Note that the sockets are switched while calibrating. It sends with
+    this process's transmitter, so the daemon must not run, see main().
+    """
+    import paho.mqtt.client as mqtt
+
+    received = queue.Queue()
+
+    def on_message(client, userdata, message):
+        try:
+            received.put(json.loads(message.payload)["decimal"])
+        except (ValueError, KeyError, TypeError):
+            logger.debug(f"Ignoring message {message.payload!r}.")
+
+    client = mqtt.Client()
+    client.on_message = on_message
+    client.connect(broker, port, 60)
+    client.subscribe(RF_RECEIVE_TOPIC)
+    client.loop_start()
+
+    def echoed(code, repeat):
+        # The receiver echoes every repeat it decodes, so echoes of the last
+        # send may still be on the way. Let them arrive, then drop them.
+        time.sleep(CALIBRATION_SETTLE)
+        while not received.empty():
+            received.get_nowait()
+        get_transmitter().send(code, repeat)
+        deadline = time.monotonic() + airtime(repeat) + 1
+        while time.monotonic() < deadline:
+            try:
+                timeout = max(0, deadline - time.monotonic())
+                if received.get(timeout=timeout) == code:
+                    return True
+            except queue.Empty:
+                break
+        return False
+
+    repeats = load_repeats()
+    try:
+        for socketnr in sockets or CODES:
+            code = CODES[socketnr][cmd]
+            reliable = None
+            for repeat in CALIBRATION_REPEATS:
+                if not all(echoed(code, repeat) for _ in range(CALIBRATION_TRIALS)):
+                    break
+                reliable = repeat
+            if reliable is None:
+                logger.warning(f"No echo for socket {socketnr}, keeping its repeats.")
+                continue
+            repeats[socketnr] = reliable + CALIBRATION_MARGIN
+            logger.info(f"Socket {socketnr} needs {reliable} repeats.")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+    save_repeats(repeats)
+    return repeats
+
+
+class Bridge:
+    """Switches sockets on MQTT commands and publishes their state.
+
+    Commands are "on" or "off" on SOCKET_COMMAND_TOPIC/<socket or scene>.
+    Commands arriving within window of each other are sent as one TxQueue
+    batch with the last command per socket. Sockets already in the
+    commanded state in socket_states are skipped. Every successful send of
+    the process, also those of daemon commands, is published as retained
+    state on SOCKET_STATE_TOPIC/<socket>.
+
+    The bridge runs in the daemon (see serve()), so it shares the
+    transmitter and the socket states with the daemon's commands.
+    """
+
+    def __init__(self, client, transmitter=None, window=BRIDGE_WINDOW):
+        self.client = client
+        self.transmitter = transmitter
+        self.window = window
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = {}
+        self.sent = 0
+        self.skipped = 0
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        socket_states.on_change = self.publish_state
+
+    def on_connect(self, client, userdata, flags, rc):
+        logger.info(f"Bridge connected with result code {rc}.")
+        # Also subscribes again after the client reconnected
+        client.subscribe(f"{SOCKET_COMMAND_TOPIC}/+", qos=1)
+
+    def on_message(self, client, userdata, message):
+        cmd = message.payload.decode(errors="replace").strip().lower()
+        try:
+            socketnr = socket_arg(message.topic.rsplit("/", 1)[-1])
+        except ValueError:
+            socketnr = None
+        sockets = SCENES.get(socketnr, [socketnr])
+        if cmd not in CMDS or any(s not in CODES for s in sockets):
+            logger.warning(f"Ignoring '{cmd}' on {message.topic}.")
+            return
+
+        with self.lock:
+            for s in sockets:
+                self.pending.pop(s, None)
+                self.pending[s] = cmd
+        self.wake.set()
+
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            time.sleep(self.window)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Sends the pending commands and publishes the new states."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        queue = TxQueue(self.transmitter)
+        for socketnr, cmd in pending.items():
+            if socket_states.get(socketnr) == cmd:
+                logger.debug(f"Socket {socketnr} is already {cmd}.")
+                self.skipped += 1
+            else:
+                queue.add(socketnr, cmd)
+        if len(queue):
+            self.sent += len(queue.flush())
+
+    def publish_state(self, socketnr, cmd):
+        self.client.publish(f"{SOCKET_STATE_TOPIC}/{socketnr}", cmd, qos=1, retain=True)
+
+
+def start_bridge(broker=MQTT_BROKER, port=MQTT_PORT):
+    """Starts a Bridge on a persistent client, see Bridge."""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client()
+    Bridge(client).start()
+    # paho connects and reconnects in its loop, the daemon never waits for it
+    client.connect_async(broker, port, 60)
+    client.loop_start()
+    return client
+
+
+def get_transmitter():
+    """Returns the transmitter shared by the whole process."""
+    global transmitter
+    if transmitter is None:
+        transmitter = Transmitter()
+        atexit.register(transmitter.close)
+    return transmitter
+
+
+def socket_arg(value):
+    """Socket number or scene name."""
+    if value in SCENES:
+        return value
+    return int(value)
+
+
+def fast_args(argv):
+    """Returns (cmd, socket) of a plain "<cmd> [socket]" call, else None.
+
+    Anything with options or invalid arguments is left to get_args.
+    """
+    if not 1 <= len(argv) <= 2 or any(arg.startswith("-") for arg in argv):
+        return None
+    cmd = argv[0]
+    if not cmd.isnumeric() and cmd not in CMDS:
+        return None
+    try:
+        socketnr = socket_arg(argv[1]) if len(argv) > 1 else 0
+    except ValueError:
+        return None
+    return cmd, socketnr
 
 
 def get_args():
+    import argparse
+
     parser = argparse.ArgumentParser(description="Optional Socket Control")
     parser.add_argument(
         "-d",
@@ -42,81 +476,298 @@ def get_args():
         help="Increase verbosity.",
     )
     parser.add_argument(
-        "cmd", help="Command for socket. Can be a decimal number or one of [on|off]."
+        "-s",
+        "--serve",
+        action="store_true",
+        help="Run as daemon that keeps the transmitter ready and accepts commands.",
+    )
+    parser.add_argument(
+        "--bridge",
+        action="store_true",
+        help="Run the daemon with a bridge that switches sockets on MQTT "
+        f"commands to {SOCKET_COMMAND_TOPIC}/<socket>.",
+    )
+    parser.add_argument(
+        "--socket-path",
+        default=SERVICE_SOCKET,
+        help="Unix socket of the daemon. Commands go through the daemon if it runs.",
+    )
+    parser.add_argument(
+        "cmd",
+        nargs="?",
+        help="Command for socket. Can be a decimal number or one of [on|off].",
     )
     parser.add_argument(
         "socket",
         default=0,
-        type=int,
+        type=socket_arg,
         nargs="?",
-        help="Socket number thats being controlled.",
+        help="Socket number thats being controlled or one of [{}].".format(
+            "|".join(SCENES)
+        ),
+    )
+    parser.add_argument(
+        "-c",
+        "--calibrate",
+        action="store_true",
+        help="Calibrate the repeat count of the socket (or all) with cmd.",
+    )
+    parser.add_argument(
+        "--broker",
+        default=MQTT_BROKER,
+        help="MQTT broker of the bridge and for the RF codes echoed by esp-bme-rf.",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        nargs="*",
+        metavar="ITEM",
+        help="Send many socket:cmd pairs (e.g. 3:on all:off) or decimal codes "
+        "at once and print the status of each. Read from stdin if none given.",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Only print the expected airtime, don't send anything.",
     )
     args = parser.parse_args()
+    if not (args.serve or args.bridge) and args.batch is None and args.cmd is None:
+        parser.error("the following arguments are required: cmd")
 
     logging.basicConfig(level=args.loglevel)
     logger.debug("Arguments: {}...".format(args))
     return args
 
 
-def socket_command(socketnr: int, cmd: str) -> bool:
-    if not cmd.isnumeric() and cmd not in CMDS:
-        logger.error("Invalid command! Use either [on|off] or an integer number.")
+def socket_command(socketnr, cmd: str, dry_run: bool = False) -> bool:
+    """Sends cmd to a socket number or scene name. See TxQueue."""
+    queue = TxQueue()
+    if not queue.add(socketnr, cmd):
         return False
+    return all(queue.flush(dry_run).values())
 
-    if cmd.isnumeric():
-        logger.info("Send decimal code {}.".format(cmd))
-        return send_decimal(int(cmd))
 
-    if socketnr not in CODES.keys():
-        logger.warning(
-            "Bad Socketnumber {}. Use one of {}.".format(socketnr, CODES.keys())
-        )
-        return False
+def batch_item(item):
+    """Returns (socket, cmd) of a "socket:cmd" batch item or decimal code.
 
-    logger.info("Send command {} to socket {} using rpi_rf.".format(cmd, socketnr))
-    return send_code(socketnr, cmd) & send_code(socketnr, cmd)
+    Raises ValueError if the item is malformed.
+    """
+    if item.isnumeric():
+        return 0, item
+    socketnr, sep, cmd = item.partition(":")
+    if not sep:
+        raise ValueError(f"Bad batch item '{item}'.")
+    return socket_arg(socketnr), cmd
 
 
-def send_code(socketnr, code):
-    ret_val = True
-    logger.debug(
-        "Sending '{}' to socket {} using rpi_rf (code {})".format(
-            code, socketnr, CODES[socketnr][code]
-        )
-    )
-    try:
-        rf_device = RFDevice(GPIO_PIN)
-        rf_device.enable_tx()
-        rf_device.tx_repeat = 20
-        rf_device.tx_code(CODES[socketnr][code], tx_pulselength=500)
-    except:
-        ret_val = False
-        logger.exception("Error while sending code to socket using rpi_rf")
-    finally:
-        rf_device.cleanup()
-    return ret_val
+def batch_command(items, dry_run=False):
+    """Sends all items as one TxQueue batch.
 
+    Returns a list of (item, status). The status is "ok", "error" if any of
+    the item's sends failed, "invalid" or "replaced" if a later item set
+    one of its sockets before anything was sent.
+    """
+    queue = TxQueue()
+    queued = []
+    for item in items:
+        try:
+            keys = queue.add(*batch_item(item))
+        except ValueError:
+            logger.error(f"Bad batch item '{item}'. Use socket:cmd or a decimal code.")
+            keys = []
+        queued.append((item, {key: queue.pending[key] for key in keys}))
 
-def send_decimal(code):
-    ret_val = True
-    logger.debug(f"'send_decimal' called. Sending code {code} using rpi_rf")
-    try:
-        rf_device = RFDevice(GPIO_PIN)
-        rf_device.enable_tx()
-        rf_device.tx_repeat = 20
-        rf_device.tx_code(code, tx_pulselength=500)
-    except:
-        ret_val = False
-        logger.exception("Error while sending code to socket using rpi_rf")
-    finally:
-        rf_device.cleanup()
-    return ret_val
+    pending = dict(queue.pending)
+    results = queue.flush(dry_run)
+    report = []
+    for item, codes in queued:
+        sent = [key for key, code in codes.items() if pending[key] == code]
+        if not codes:
+            status = "invalid"
+        elif not all(results[key] for key in sent):
+            status = "error"
+        elif len(sent) < len(codes):
+            status = "replaced"
+        else:
+            status = "ok"
+        report.append((item, status))
+    return report
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """Handles daemon requests: one "<cmd> [socket]" line per command.
+
+    Every line is answered with "ok" or "error". A "batch <item>..." line
+    runs batch_command and is answered with the status of every item.
+    """
+
+    def handle(self):
+        try:
+            for line in self.rfile:
+                self.wfile.write(self.reply(line))
+        except BrokenPipeError:
+            logger.warning("Client gave up before the reply.")
+
+    def reply(self, line):
+        request = line.decode(errors="replace").split()
+        if request[:1] == ["batch"]:
+            report = batch_command(request[1:])
+            reply = " ".join(status for _, status in report)
+            return f"{reply}\n".encode()
+        try:
+            cmd = request[0]
+            socketnr = socket_arg(request[1]) if len(request) > 1 else 0
+        except (IndexError, ValueError):
+            logger.warning(f"Bad request {line!r}.")
+            return b"error\n"
+        return b"ok\n" if socket_command(socketnr, cmd) else b"error\n"
+
+
+def serve(path=SERVICE_SOCKET, broker=None):
+    """Accepts commands on a unix socket until interrupted.
+
+    With broker, the MQTT bridge runs in the daemon as well.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    get_transmitter().open()
+    client = start_bridge(broker) if broker else None
+
+    with socketserver.ThreadingUnixStreamServer(path, CommandHandler) as server:
+        logger.info(f"Waiting for commands on {path}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("stopping...")
+        finally:
+            os.unlink(path)
+            if client is not None:
+                client.loop_stop()
+                client.disconnect()
+
+
+def daemon_request(request, airtime, path=SERVICE_SOCKET, timeout=DAEMON_TIMEOUT):
+    """Sends one request line to the daemon and returns its reply line.
+
+    Raises FileNotFoundError or ConnectionRefusedError if no daemon listens
+    on path. Once the request is sent, the daemon may be sending it, so
+    errors and a missing reply after airtime plus timeout return None.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        # The daemon answers after the request is on air. Other requests
+        # and the bridge may be sending before it, hence the timeout on top.
+        sock.settimeout(airtime + timeout)
+        try:
+            sock.sendall(f"{request}\n".encode())
+            reply = sock.makefile().readline().strip()
+        except OSError as e:
+            logger.error(f"No reply from the daemon to '{request}' ({e}).")
+            return None
+    logger.debug(f"Daemon replied '{reply}' to '{request}'.")
+    return reply
+
+
+def daemon_command(socketnr, cmd, path=SERVICE_SOCKET):
+    """Sends a command to the daemon, see daemon_request."""
+    queue = TxQueue()
+    queue.add(socketnr, cmd)
+    return daemon_request(f"{cmd} {socketnr}", queue.airtime(), path) == "ok"
+
+
+def daemon_batch(items, path=SERVICE_SOCKET):
+    """Has the daemon send the items as one batch, see batch_command.
+
+    Returns a list of (item, status) like batch_command, see daemon_request
+    for errors.
+    """
+    queue = TxQueue()
+    for item in items:
+        try:
+            queue.add(*batch_item(item))
+        except ValueError:
+            pass
+    reply = daemon_request("batch {}".format(" ".join(items)), queue.airtime(), path)
+    statuses = (reply or "").split()
+    if len(statuses) != len(items):
+        logger.error(f"Daemon replied {statuses} to a batch of {len(items)}.")
+        statuses = ["error"] * len(items)
+    return list(zip(items, statuses))
+
+
+def daemon_running(path=SERVICE_SOCKET):
+    """Returns whether a daemon accepts connections on path."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
+
+
+def run_batch(items, path=SERVICE_SOCKET, dry_run=False):
+    """Sends the batch through the daemon if it runs, else directly."""
+    if not dry_run and os.path.exists(path):
+        try:
+            return daemon_batch(items, path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            logger.warning("Daemon not reachable, sending directly.")
+    return batch_command(items, dry_run)
+
+
+def run_command(socketnr, cmd, path=SERVICE_SOCKET):
+    """Sends cmd through the daemon if it runs, else directly."""
+    if os.path.exists(path):
+        try:
+            return daemon_command(socketnr, cmd, path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            logger.warning("Daemon not reachable, sending directly.")
+    return socket_command(socketnr, cmd)
 
 
 def main():
+    fast = fast_args(sys.argv[1:])
+    if fast:
+        logging.basicConfig(level=logging.WARNING)
+        cmd, socketnr = fast
+        sys.exit(not run_command(socketnr, cmd))
+
     args = get_args()
 
-    ret_val = socket_command(args.socket, args.cmd)
+    if args.serve or args.bridge:
+        serve(args.socket_path, args.broker if args.bridge else None)
+        return
+
+    if args.calibrate:
+        if args.cmd not in CMDS or args.socket not in [0, *CODES]:
+            logger.error("Calibrate with [on|off] and a socket number or none.")
+            sys.exit(1)
+        # The daemon owns the transmitter and would not know the new states
+        if daemon_running(args.socket_path):
+            logger.error(f"Stop the daemon on {args.socket_path} to calibrate.")
+            sys.exit(1)
+        sockets = [args.socket] if args.socket else None
+        repeats = calibrate(args.cmd, sockets, args.broker)
+        print("Repeats: {}".format(repeats))
+        return
+
+    if args.batch is not None:
+        items = args.batch or sys.stdin.read().split()
+        report = run_batch(items, args.socket_path, args.dry_run)
+        for item, status in report:
+            print("{} {}".format(item, status))
+        ret_val = all(status in ("ok", "replaced") for _, status in report)
+        sys.exit(not ret_val)
+
+    if args.dry_run:
+        queue = TxQueue()
+        ret_val = queue.add(args.socket, args.cmd)
+        print("Expected airtime: {:.2f}s".format(queue.airtime()))
+        sys.exit(not ret_val)
+
+    ret_val = run_command(args.socket, args.cmd, args.socket_path)
     sys.exit(not ret_val)
 
 
@@ -2,9 +2,13 @@
 from https://github.com/tinue/APA102_Pi
 This is the main driver module for APA102 LEDs
 """
+import numpy
 import spidev
 from math import ceil
 
+SPI_BUFSIZE_PATH = "/sys/module/spidev/parameters/bufsize"
+SPI_BUFSIZE_DEFAULT = 4096
+
 RGB_MAP = {
     "rgb": [3, 2, 1],
     "rbg": [3, 1, 2],
@@ -15,6 +19,16 @@ RGB_MAP = {
 }
 
 
+def spi_bufsize():
+    """Maximum number of bytes spidev accepts in one transfer."""
+
+    try:
+        with open(SPI_BUFSIZE_PATH) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return SPI_BUFSIZE_DEFAULT
+
+
 class APA102:
     """
     Driver for APA102 LEDS (aka "DotStar").
@@ -26,6 +40,7 @@ class APA102:
     Public methods are:
      - set_pixel
      - set_pixel_rgb
+     - set_pixels
      - show
      - clear_strip
      - cleanup
@@ -81,6 +96,7 @@ class APA102:
     # Constants
     MAX_BRIGHTNESS = 31  # Safeguard: Set to a value appropriate for your setup
     LED_START = 0b11100000  # Three "1" bits, followed by 5 brightness bits
+    MAX_COLOR_LUTS = 64  # Number of cached fade levels, see color_lut
 
     def __init__(
         self,
@@ -90,22 +106,80 @@ class APA102:
         bus=0,
         device=1,
         max_speed_hz=8000000,
+        bufsize=None,
+        gamma=1.0,
+        fade_gamma=1.0,
     ):
         self.num_led = num_led  # The number of LEDs in the Strip
         order = order.lower()
         self.rgb = RGB_MAP.get(order, RGB_MAP["rgb"])
-        # Limit the brightness to the maximum if it's set higher
-        if global_brightness > self.MAX_BRIGHTNESS:
-            self.global_brightness = self.MAX_BRIGHTNESS
-        else:
-            self.global_brightness = global_brightness
-
-        self.leds = [self.LED_START, 0, 0, 0] * self.num_led  # Pixel buffer
+        self.global_brightness = global_brightness  # Also builds brightness_lut
+        # Gamma correction of color values and of fade levels, see color_lut
+        self.gamma = gamma
+        self.fade_gamma = fade_gamma
+        self.color_luts = {}
+
+        # The whole frame lives in one preallocated buffer: 4 bytes start
+        # frame, 4 bytes per LED and the end frame zeroes (see clock_end_frame)
+        self.end_frame_len = (self.num_led + 15) // 16
+        self.frame = bytearray(4 + 4 * self.num_led + self.end_frame_len)
+        self.frame[4 : 4 + 4 * self.num_led] = (
+            bytes([self.LED_START, 0, 0, 0]) * self.num_led
+        )
+        self.leds = memoryview(self.frame)[4 : 4 + 4 * self.num_led]  # Pixel buffer
+        # (num_led, 4) numpy view of the pixel buffer for bulk updates
+        self.pixel_array = numpy.frombuffer(self.frame, dtype=numpy.uint8)[
+            4 : 4 + 4 * self.num_led
+        ].reshape(self.num_led, 4)
+        self.end_frame = memoryview(self.frame)[4 + 4 * self.num_led :]
+        # The pixel buffer is a ring: LED i shows buffer pixel (i + offset)
+        self.offset = 0
+        self.rotated_frame = None  # Frame in strip order while rotated
+        # The end frame zeroes also get LED one ready for the next update.
+        # With at least 32 of them the next start frame can be omitted.
+        self.skip_start_frame = self.end_frame_len >= 4
+        self.frame_sent = False
         self.spi = spidev.SpiDev()  # Init the SPI device
         self.spi.open(bus, device)  # Open SPI port 0, slave device (CS) 1
         # Up the speed a bit, so that the LEDs are painted faster
         if max_speed_hz:
             self.spi.max_speed_hz = max_speed_hz
+        # Larger frames have to be split into several transfers
+        self.bufsize = bufsize or spi_bufsize()
+
+    @property
+    def global_brightness(self):
+        return self._global_brightness
+
+    @global_brightness.setter
+    def global_brightness(self, global_brightness):
+        # Limit the brightness to the maximum if it's set higher
+        self._global_brightness = min(global_brightness, self.MAX_BRIGHTNESS)
+
+        # LED start bytes for all brightness percentages from 0 to 100.
+        # Round up to nearest integer as we expect some brightness unless set to 0
+        brightness = numpy.ceil(numpy.arange(101) * self._global_brightness / 100.0)
+        brightness = brightness.astype(numpy.uint8)
+        self.brightness_lut = (brightness & 0b00011111) | self.LED_START
+
+    def color_lut(self, scale=1.0):
+        """Returns the 256 entry table that maps color values to sent values.
+
+        The values are faded by scale first and then gamma corrected. The
+        fade level itself is corrected with fade_gamma, so that fades look
+        even to the eye without changing the undimmed colors. With both
+        gammas at 1.0 the table is int(value * scale).
+        Tables are cached per fade level.
+        """
+        lut = self.color_luts.get(scale)
+        if lut is None:
+            if len(self.color_luts) >= self.MAX_COLOR_LUTS:
+                self.color_luts.clear()
+            values = numpy.floor(numpy.arange(256) * scale**self.fade_gamma)
+            values = numpy.round(255 * (values / 255) ** self.gamma)
+            lut = numpy.clip(values, 0, 255).astype(numpy.uint8)
+            self.color_luts[scale] = lut
+        return lut
 
     def clock_start_frame(self):
         """Sends a start frame to the LED strip.
@@ -113,7 +187,7 @@ class APA102:
         This method clocks out a start frame, telling the receiving LED
         that it must update its own color now.
         """
-        self.spi.xfer2([0] * 4)  # Start frame, 32 zero bits
+        self.write(self.frame[:4])  # Start frame, 32 zero bits
 
     def clock_end_frame(self):
         """Sends an end frame to the LED strip.
@@ -138,13 +212,11 @@ class APA102:
         Ultimately, we need to send additional numLEDs/2 arbitrary data bits,
         in order to trigger numLEDs/2 additional clock changes. This driver
         sends zeroes, which has the benefit of getting LED one partially or
-        fully ready for the next update to the strip. An optimized version
-        of the driver could omit the "clockStartFrame" method if enough zeroes have
-        been sent as part of "clockEndFrame".
+        fully ready for the next update to the strip. show() omits the start
+        frame if enough zeroes have been sent as part of the previous end frame.
         """
-        # Round up num_led/2 bits (or num_led/16 bytes)
-        for _ in range((self.num_led + 15) // 16):
-            self.spi.xfer2([0x00])
+        # Round up num_led/2 bits (or num_led/16 bytes), sent in one transfer
+        self.write(self.end_frame)
 
     def clear_strip(self):
         """Turns off the strip and shows the result right away."""
@@ -165,16 +237,19 @@ class APA102:
         if led_num >= self.num_led:
             return  # again, invisible
 
-        # Calculate pixel brightness as a percentage of the
-        # defined global_brightness. Round up to nearest integer
-        # as we expect some brightness unless set to 0
-        brightness = ceil(bright_percent * self.global_brightness / 100.0)
-        brightness = int(brightness)
+        if type(bright_percent) is int and 0 <= bright_percent <= 100:
+            ledstart = int(self.brightness_lut[bright_percent])
+        else:
+            # Calculate pixel brightness as a percentage of the
+            # defined global_brightness. Round up to nearest integer
+            # as we expect some brightness unless set to 0
+            brightness = ceil(bright_percent * self.global_brightness / 100.0)
+            brightness = int(brightness)
 
-        # LED startframe is three "1" bits, followed by 5 brightness bits
-        ledstart = (brightness & 0b00011111) | self.LED_START
+            # LED startframe is three "1" bits, followed by 5 brightness bits
+            ledstart = (brightness & 0b00011111) | self.LED_START
 
-        start_index = 4 * led_num
+        start_index = 4 * ((led_num + self.offset) % self.num_led)
         self.leds[start_index] = ledstart
         self.leds[start_index + self.rgb[0]] = red
         self.leds[start_index + self.rgb[1]] = green
@@ -196,26 +271,100 @@ class APA102:
             bright_percent,
         )
 
+    def set_pixels(self, pixels, bright_percent=100, scale=1.0):
+        """Sets the colors of many pixels at once, starting with the first one.
+
+        pixels is an (N, 3) array of red, green and blue values, or an
+        (N, 4) array whose first column is a per pixel brightness percentage
+        replacing bright_percent. Lists and flat buffers of RGB bytes work,
+        too. Everything is written to the pixel buffer in one vectorized
+        step; values are clipped to 0..255 and pixels beyond the end of the
+        strip are ignored.
+
+        The colors are faded by scale and gamma corrected with one lookup
+        in color_lut, brightness percentages are looked up in brightness_lut.
+        """
+        if isinstance(pixels, (bytes, bytearray, memoryview)):
+            pixels = numpy.frombuffer(pixels, dtype=numpy.uint8)
+        pixels = numpy.asarray(pixels)
+        if pixels.ndim == 1:
+            pixels = pixels.reshape(-1, 3)
+        pixels = pixels[: self.num_led]
+
+        if pixels.shape[1] == 4:
+            percent = numpy.clip(numpy.ceil(pixels[:, 0]), 0, 100)
+            ledstart = numpy.take(self.brightness_lut, percent.astype(numpy.intp))
+            pixels = pixels[:, 1:]
+        else:
+            bright_percent = int(ceil(min(max(bright_percent, 0), 100)))
+            ledstart = numpy.full(
+                len(pixels), self.brightness_lut[bright_percent], numpy.uint8
+            )
+        if pixels.dtype != numpy.uint8:
+            pixels = numpy.clip(pixels, 0, 255).astype(numpy.uint8)
+        pixels = numpy.take(self.color_lut(scale), pixels)
+
+        # Starting at the ring offset the pixels may wrap around the buffer end
+        first = min(len(pixels), self.num_led - self.offset)
+        for target, part in (
+            (self.pixel_array[self.offset : self.offset + first], slice(0, first)),
+            (self.pixel_array[: len(pixels) - first], slice(first, None)),
+        ):
+            target[:, 0] = ledstart[part]
+            target[:, self.rgb] = pixels[part]
+
     def rotate(self, positions=1):
         """Rotate the LEDs by the specified number of positions.
 
         Treating the internal LED array as a circular buffer, rotate it by
         the specified number of positions. The number could be negative,
         which means rotating in the opposite direction.
+
+        Only the ring offset is moved, the pixels are put into strip order
+        when the next frame is sent.
         """
-        cutoff = 4 * (positions % self.num_led)
-        self.leds = self.leds[cutoff:] + self.leds[:cutoff]
+        self.offset = (self.offset + positions) % self.num_led
 
     def show(self):
         """Sends the content of the pixel buffer to the strip.
 
-        Todo: More than 1024 LEDs requires more than one xfer operation.
+        Start frame, LED frames and end frame are sent with writebytes2.
+        Unlike xfer2 it does not overwrite its argument, so the frame buffer
+        can be handed over without copying it first.
+
+        From the second frame on, the start frame is left out if the end
+        frame of the previous one already clocked out 32 zero bits.
+
+        While the strip is rotated, the two halves of the ring are copied
+        into a second frame buffer in strip order and that one is sent.
+        """
+        frame = self.frame
+        if self.offset:
+            if self.rotated_frame is None:
+                self.rotated_frame = bytearray(self.frame)
+            frame = self.rotated_frame
+            cutoff = 4 * self.offset
+            tail = 4 * self.num_led - cutoff
+            frame[4 : 4 + tail] = self.leds[cutoff:]
+            frame[4 + tail : 4 + 4 * self.num_led] = self.leds[:cutoff]
+
+        if self.frame_sent and self.skip_start_frame:
+            self.write(memoryview(frame)[4:])
+        else:
+            self.write(frame)
+            self.frame_sent = True
+
+    def write(self, data):
+        """Writes a buffer to the strip.
+
+        spidev refuses transfers larger than its buffer size (4096 bytes
+        by default, which is about 1020 LEDs), so the buffer is sent in
+        bufsize chunks. The LEDs only look at the clock, so splitting a
+        frame between transfers does not matter to them.
         """
-        self.clock_start_frame()
-        # xfer2 kills the list, unfortunately. So it must be copied first
-        # SPI takes up to 4096 Integers. So we are fine for up to 1024 LEDs.
-        self.spi.xfer2(list(self.leds))
-        self.clock_end_frame()
+        view = memoryview(data)
+        for start in range(0, len(view), self.bufsize):
+            self.spi.writebytes2(view[start : start + self.bufsize])
 
     def cleanup(self):
         """Release the SPI device; Call this method at the end"""
@@ -245,4 +394,5 @@ class APA102:
     def dump_array(self):
         """For debug purposes: Dump the LED array onto the console."""
 
-        print(self.leds)
+        cutoff = 4 * self.offset
+        print(list(self.leds[cutoff:]) + list(self.leds[:cutoff]))
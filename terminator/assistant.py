@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
 
 import os
-import re
 import sys
 import time
 import argparse
-import struct
 import json
 import socket
 import logging
+import threading
 import subprocess
+from collections import deque
 from threading import Timer
 
+try:
+    import queue as Queue
+except ImportError:
+    import Queue as Queue
+
 import pvporcupine
 import pyaudio
 import paho.mqtt.client as mqtt
@@ -20,30 +25,46 @@ from vosk import Model, KaldiRecognizer
 # sys.path.append('/home/pi/projects/rpi-projects')
 # import socketctl
 from pixels import Pixels
+from grammar import Grammar
+from connection import Connection
 from led_patterns import LedPattern
 
 logger = logging.getLogger(__name__)
 
 FPB = 8000
+PARTIAL_FPB = 1600  # Smaller chunks for early dispatch on partial results
 CHANNELS = 1
 RATE = 16000
 FORMAT = pyaudio.paInt16
-SEARCH_WORDS = (
-    "turn computer socket one two three four five turn on off "
-    "start shutdown exit coffee make set timer cancel"
-)
+PREROLL = 0.2  # Seconds of audio before the keyword end fed to the recognizer
+CAPTURE_QUEUE_SECONDS = 2  # Audio buffered for the recognizer before overruns
 MQTT_DEVICE_NAME = "terminator"
 MQTT_INFO_TOPIC = f"mqtt/{MQTT_DEVICE_NAME}/commands"
 MQTT_TOPIC = "room/control/command"
+# Socket states, as socketctl publishes them. Not the command topic, that
+# would make the socketctl bridge switch the socket a second time.
+MQTT_SOCKET_STATE_TOPIC = "room/data/socket"
 MQTT_STATUS_TOPIC = f"mqtt/{MQTT_DEVICE_NAME}/status"
 MQTT_INFO_TOPIC = f"mqtt/{MQTT_DEVICE_NAME}/command"
 
 NUMBERS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6}
-SOCKET_COMMANDS_REGEX = [
-    rf"turn (?P<command>on|off) socket (?P<socket_nr>{'|'.join(NUMBERS.keys())})",
-    rf"turn socket (?P<socket_nr>{'|'.join(NUMBERS.keys())}) (?P<command>on|off)",
+COMMAND_TABLE = [
+    ("exit", "exit"),
+    ("coffee_timer", "set coffee timer"),
+    ("coffee_timer", "make coffee"),
+    ("computer", "turn computer {command}"),
+    ("socket", "turn {command} socket {socket_nr}"),
+    ("socket", "turn socket {socket_nr} {command}"),
 ]
+COMMAND_SLOTS = {"command": {"on": "on", "off": "off"}, "socket_nr": NUMBERS}
+# Also the vosk grammar, so only these phrases can be recognized
+GRAMMAR = Grammar(COMMAND_TABLE, COMMAND_SLOTS)
 ONLINE_PUBLISH_TIMER = 900
+SOCKETCTL_PATH = "/home/pi/projects/rpi-projects/socketctl.py"
+SOCKETCTL_SOCKET = "/tmp/socketctl.sock"
+# Seconds to wait for the daemon's reply. A command may wait for a scene of
+# the bridge and the "all" scene alone is on air for almost 13 seconds.
+SOCKETCTL_TIMEOUT = 60
 
 pixels = None
 porcupine = None
@@ -55,6 +76,12 @@ pixels = Pixels()
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-m", "--model", help="Path of model folder")
+    parser.add_argument(
+        "-e",
+        "--early-dispatch",
+        action="store_true",
+        help="Run commands as soon as the partial result is a complete command.",
+    )
     parser.add_argument(
         "-d",
         "--debug",
@@ -77,94 +104,231 @@ def get_args():
     return args
 
 
-def get_keyword_blocking(porcupine, pa, pixels):
-    detected = False
-    try:
-        stream = pa.open(
+class CaptureClosed(Exception):
+    pass
+
+
+class Startup:
+    """Runs the slow startup phases in parallel and logs their durations.
+
+    Loading the vosk model takes by far the longest on a Pi, so it runs in
+    the background while porcupine is created.
+    Exceptions of a phase are raised again when its result is collected.
+    """
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.durations = {}
+        self.results = {}
+        self.threads = {}
+
+    def run(self, name, func, *args):
+        start = time.monotonic()
+        try:
+            self.results[name] = (func(*args), None)
+        except Exception as e:
+            self.results[name] = (None, e)
+        self.durations[name] = time.monotonic() - start
+        logger.debug(
+            "Startup phase {} took {:.2f}s.".format(name, self.durations[name])
+        )
+
+    def background(self, name, func, *args):
+        thread = threading.Thread(target=self.run, args=(name, func) + args)
+        thread.daemon = True
+        thread.start()
+        self.threads[name] = thread
+
+    def result(self, name):
+        if name in self.threads:
+            self.threads.pop(name).join()
+        result, error = self.results[name]
+        if error is not None:
+            raise error
+        return result
+
+    def done(self):
+        phases = ", ".join(
+            "{} {:.2f}s".format(name, duration)
+            for name, duration in self.durations.items()
+        )
+        logger.info(
+            "Startup took {:.2f}s ({}).".format(
+                time.monotonic() - self.start_time, phases
+            )
+        )
+
+
+class AudioCapture:
+    """One capture stream that stays open for the lifetime of the assistant.
+
+    The stream runs in PyAudio callback mode and pushes every frame into a
+    bounded queue. Keyword detection and command recognition both read
+    from it, so no audio is lost between the two. If the reader falls
+    behind for more than CAPTURE_QUEUE_SECONDS, frames are dropped and
+    counted as overruns, as are input overflows reported by PortAudio.
+    The last PREROLL seconds are kept in a ring buffer, so the recognizer
+    can start on audio from just before the keyword was detected.
+    """
+
+    def __init__(
+        self,
+        pa,
+        rate=RATE,
+        frame_length=512,
+        preroll=PREROLL,
+        queue_seconds=CAPTURE_QUEUE_SECONDS,
+    ):
+        self.frame_length = frame_length
+        self.ring = deque(maxlen=max(1, int(preroll * rate / frame_length)))
+        self.frames = Queue.Queue(
+            maxsize=max(1, int(queue_seconds * rate / frame_length))
+        )
+        self.max_depth = 0
+        self.overruns = 0
+        self.closed = False
+        self.keyword_time = None
+        self.first_word_latency = None
+        self.command_latency = None
+        self.stream = pa.open(
             format=FORMAT,
             channels=CHANNELS,
-            rate=porcupine.sample_rate,
-            frames_per_buffer=porcupine.frame_length,
+            rate=rate,
+            frames_per_buffer=frame_length,
             input=True,
+            stream_callback=self.callback,
         )
 
-        logger.info("...waiting for keyword")
-        while stream.is_active():
-            pcm = stream.read(porcupine.frame_length)
-            pcm = struct.unpack_from("h" * porcupine.frame_length, pcm)
-
-            result = porcupine.process(pcm)
-            if result >= 0:
-                pixels.alexa_wakeup()
-                logger.debug("keyword detected.")
-                stream.stop_stream()
-                detected = True
-
-    finally:
+    def callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paInputOverflow:
+            self.overruns += 1
+        try:
+            self.frames.put_nowait(in_data)
+        except Queue.Full:
+            self.overruns += 1
+        self.max_depth = max(self.max_depth, self.frames.qsize())
+        return (None, pyaudio.paContinue)
+
+    def read(self, frames=None):
+        """Returns the next frames, one porcupine frame by default.
+
+        Raises CaptureClosed once the stream is closed.
+        """
+        frames = frames or self.frame_length
+        chunks = []
+        for _ in range((frames + self.frame_length - 1) // self.frame_length):
+            pcm = self.frames.get()
+            if pcm is None:
+                self.frames.put(None)  # Wake up any other reader, too
+                raise CaptureClosed()
+            self.ring.append(pcm)
+            chunks.append(pcm)
+        return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+    def read_pcm(self):
+        """Returns the next porcupine frame as a sequence of 16 bit samples.
+
+        The samples are a memoryview over the bytes read, so nothing is
+        copied or converted to Python ints up front.
+        """
+        return memoryview(self.read()).cast("h")
+
+    def preroll(self):
+        """Returns and empties the audio in the ring buffer."""
+        pcm = b"".join(self.ring)
+        self.ring.clear()
+        return pcm
+
+    def stats(self):
+        return {
+            "depth": self.frames.qsize(),
+            "max_depth": self.max_depth,
+            "overruns": self.overruns,
+        }
+
+    def close(self):
         logger.debug("closing stream")
-        stream.close()
-        logger.debug("turning pixels off")
-        time.sleep(1)
-        pixels.off()
-    return detected
+        self.closed = True
+        self.stream.stop_stream()
+        self.stream.close()
+        # The callback is done, make room for the end marker if the queue is full
+        while True:
+            try:
+                self.frames.put_nowait(None)
+                break
+            except Queue.Full:
+                self.frames.get_nowait()
+
+
+def get_keyword_blocking(porcupine, capture, pixels):
+    logger.info("...waiting for keyword")
+    while True:
+        result = porcupine.process(capture.read_pcm())
+        if result >= 0:
+            capture.keyword_time = time.monotonic()
+            pixels.alexa_wakeup()
+            logger.debug("keyword detected.")
+            return True
+
 
+def get_command_blocking(recognizer, capture, pixels, early=False):
+    """Returns the next recognized command.
 
-def get_command_blocking(recognizer, pa, pixels):
+    Normally the command is the final result, after the recognizer detected
+    the end of the utterance. With early, smaller chunks are recognized and
+    the partial result is returned as soon as it is a complete command.
+    The time from the chunk in which the last word showed up to returning
+    the command is kept as capture.command_latency.
+    """
     command = ""
+    partial = ""
+    last_word_time = None
     pixels.alexa_speak()
     try:
-        stream = pa.open(
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=RATE,
-            frames_per_buffer=FPB,
-            input=True,
-        )
-
         logger.info("...waiting for command")
+        # The recognizer is reused for every command, start from a clean state
+        recognizer.Reset()
 
-        while stream.is_active():
-            pcm = stream.read(FPB)
-
+        pcm = capture.preroll()
+        while True:
             if recognizer.AcceptWaveform(pcm):
                 result = json.loads(recognizer.Result())
                 logger.debug(f"Result: '{result}'.")
-                stream.stop_stream()
                 command = result["text"]
+                break
+
+            text = json.loads(recognizer.PartialResult())["partial"]
+            if text != partial:
+                if not partial and capture.keyword_time is not None:
+                    capture.first_word_latency = time.monotonic() - capture.keyword_time
+                    logger.info(
+                        "First word recognized {:.2f}s after keyword.".format(
+                            capture.first_word_latency
+                        )
+                    )
+                partial = text
+                last_word_time = time.monotonic()
+
+                if early and GRAMMAR.complete(text):
+                    logger.debug(f"Partial result '{text}' is a command.")
+                    recognizer.Reset()
+                    command = text
+                    break
+            pcm = capture.read(PARTIAL_FPB if early else FPB)
 
     finally:
-        logger.debug("closing stream")
-        stream.close()
         pixels.off()
 
+    if last_word_time is not None:
+        capture.command_latency = time.monotonic() - last_word_time
+        logger.info(
+            "Command dispatched {:.2f}s after the last word ({} result).".format(
+                capture.command_latency, "partial" if early else "final"
+            )
+        )
     return command
 
 
-def connect(client):
-    brokers = ["localhost"]
-    port = 8883
-    for host in brokers:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        logger.debug(f"Try connection to broker {host} on port {port}.")
-        if sock.connect_ex((host, port)) == 0:
-            try:
-                client.connect(host, port, 60)
-                logger.info(f"Connected to broker on host {host}.")
-                break
-            except ConnectionRefusedError:
-                logger.warning("Broker refused connection. Are host/port correct?")
-            except socket.gaierror:
-                logger.warning(
-                    "Connection to broker failed. Hostname is probably not valid."
-                )
-            except TimeoutError:
-                logger.warning("Connecting to broker timed out.")
-    else:
-        logger.error("Could not connect to broker.")
-        return None
-    return client
-
-
 def on_mqtt_connect(client, userdata, flags, rc):
     logger.debug(f"Connected with result code {rc}.")
     client.publish(MQTT_STATUS_TOPIC, payload="online", qos=0)
@@ -178,15 +342,37 @@ def coffee_alarm(pixels):
 
 
 def socketctl(socket_nr, cmd):
+    """Switches a socket, returns whether socketctl succeeded."""
+    # Prefer the running socketctl daemon (socketctl.py --serve), it keeps
+    # the transmitter ready and needs no new process
     try:
-        proc = subprocess.run(
-            ["/home/pi/projects/rpi-projects/socketctl.py", cmd, str(socket_nr)]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(SOCKETCTL_TIMEOUT)
+            sock.connect(SOCKETCTL_SOCKET)
+            # Sent is sent: never fall back to socketctl.py from here on, the
+            # daemon may still be sending and would send it a second time
+            try:
+                sock.sendall(f"{cmd} {socket_nr}\n".encode())
+                reply = sock.makefile().readline().strip()
+            except OSError:
+                logger.exception("No reply from socketctl daemon.")
+                return False
+        logger.debug(
+            "Socketctl daemon {} {} returned {}...".format(socket_nr, cmd, reply)
         )
+        return reply == "ok"
+    except (FileNotFoundError, ConnectionRefusedError):
+        logger.debug("Socketctl daemon not reachable, running socketctl.py.")
+
+    try:
+        proc = subprocess.run([SOCKETCTL_PATH, cmd, str(socket_nr)])
         logger.debug(
             "Socketctl {} {} returned {}...".format(socket_nr, cmd, proc.returncode)
         )
+        return proc.returncode == 0
     except FileNotFoundError:
         logger.exception("Socketctl failed.")
+        return False
 
 
 #############################
@@ -200,35 +386,68 @@ def coffee_timer():
         pixels.pattern.timer(4 * 60)
 
     pixels.put(f)
-    time.sleep(4 * 60)
     # coffee_alarm(pixels)
-    pixels.put(pixels.pattern.alarm)
+    alarm = Timer(4 * 60, pixels.put, [pixels.pattern.alarm])
+    alarm.daemon = True
+    alarm.start()
 
 
-def computer_control(command, client):
-    cmd = command.replace("turn computer", "").strip()
-    if cmd == "on" or cmd == "off":
-        pixels.put(pixels.pattern.cmd_accepted)
-        logger.info("Computer {} message detected.".format(cmd))
-        # socketctl.socket_command(1, cmd)
-        socketctl(1, cmd)
-        client.publish("room/control/computer", cmd)
+def computer_control(cmd, client):
+    pixels.put(pixels.pattern.cmd_accepted)
+    logger.info("Computer {} message detected.".format(cmd))
+    # socketctl.socket_command(1, cmd)
+    socketctl(1, cmd)
+    client.publish("room/control/computer", cmd)
+
+
+def socket_control(socket_nr, cmd, client):
+    pixels.put(pixels.pattern.cmd_accepted)
+    # socketctl.socket_command(socket_nr, cmd)
+    if socketctl(socket_nr, cmd):
+        client.publish(
+            f"{MQTT_SOCKET_STATE_TOPIC}/{socket_nr}", cmd, qos=1, retain=True
+        )
+
+
+def dispatch(command, client):
+    """Runs a recognized command. Returns False if the assistant should exit."""
+    client.publish(MQTT_INFO_TOPIC, payload=command, qos=1)
+
+    intent, slots = GRAMMAR.match(command)
+    if intent == "exit":
+        logging.info("Exiting app.")
+        return False
+    elif intent == "coffee_timer":
+        coffee_timer()
+
+    elif intent == "computer":
+        computer_control(slots["command"], client)
+
+    elif intent == "socket":
+        socket_control(slots["socket_nr"], slots["command"], client)
+
     else:
+        logger.info(f"Command '{command}' not understood.")
         pixels.put(pixels.pattern.cmd_rejected)
-        logger.info("Computer on message badly formed.")
-
-
-def socket_control(command, client):
-    for command_re in SOCKET_COMMANDS_REGEX:
-        m = re.match(command_re, command)
-        if m:
-            socket_nr = NUMBERS[m.group("socket_nr")]
-            cmd = m.group("command")
-            # socketctl.socket_command(socket_nr, cmd)
-            socketctl(socket_nr, cmd)
-            client.publish(f"{MQTT_TOPIC}/socket/{socket_nr}", cmd)
-            return True
-    return False
+    return True
+
+
+def load_recognizer(model_path):
+    """Loads the vosk model and creates the one recognizer used for all commands."""
+    model = Model(model_path)
+    return KaldiRecognizer(model, RATE, GRAMMAR.vosk_grammar())
+
+
+def recognize(porcupine, recognizer, capture, commands, early=False):
+    """Recognizer worker: queues every recognized command for main()."""
+    try:
+        while True:
+            if get_keyword_blocking(porcupine, capture, pixels):
+                command = get_command_blocking(recognizer, capture, pixels, early)
+                logger.info(f"Recognized command: '{command}'.")
+                commands.put(command)
+    except CaptureClosed:
+        logger.debug("Capture closed, recognizer stopped.")
 
 
 def main():
@@ -237,10 +456,6 @@ def main():
 
     pixels.pattern = LedPattern(show=pixels.show)
 
-    client = mqtt.Client()
-    client.on_connect = on_mqtt_connect
-    client = connect(client)
-
     if args.model and os.path.exists(args.model):
         logger.debug("Using supplied model path.")
         model_path = args.model
@@ -252,57 +467,77 @@ def main():
         )
         sys.exit(1)
 
-    try:
-        pa = pyaudio.PyAudio()
+    # The model loads while porcupine is created
+    startup = Startup()
+    startup.background("model", load_recognizer, model_path)
 
-        porcupine = pvporcupine.create(keywords=["terminator", "blueberry"])
+    # Connects in the background, publishes are queued until then
+    client = Connection(mqtt.Client(), on_connect=on_mqtt_connect)
+    client.start()
 
-        model = Model(model_path)
-        recognizer = KaldiRecognizer(model, 16000, SEARCH_WORDS)
+    pa = None
+    porcupine = None
+    capture = None
+    worker = None
+    try:
+        startup.run("audio", pyaudio.PyAudio)
+        pa = startup.result("audio")
+        startup.run(
+            "porcupine",
+            lambda: pvporcupine.create(keywords=["terminator", "blueberry"]),
+        )
+        porcupine = startup.result("porcupine")
+        recognizer = startup.result("model")
+        startup.done()
+
+        # Audio is captured in PyAudio's callback thread and recognized in a
+        # worker thread. Commands are handled here, so slow handlers never
+        # make the assistant miss audio.
+        capture = AudioCapture(pa, porcupine.sample_rate, porcupine.frame_length)
+        commands = Queue.Queue()
+        worker = threading.Thread(
+            target=recognize,
+            args=(porcupine, recognizer, capture, commands, args.early_dispatch),
+        )
+        worker.daemon = True
+        worker.start()
         pixels.put(pixels.pattern.cmd_accepted)
 
-        client.loop_start()
         start_time = time.time()
-        while keep_running:
+        while keep_running and worker.is_alive():
             # publish online status every hour
             if time.time() - start_time > ONLINE_PUBLISH_TIMER:
-                client.publish(MQTT_STATUS_TOPIC, payload="online", qos=0, retain=False)
+                client.publish(MQTT_STATUS_TOPIC, payload="online", buffer=False)
+                logger.info(f"Audio capture: {capture.stats()}.")
+                logger.info(f"MQTT: {client.stats()}.")
                 start_time = time.time()
 
             # handle voice commands
-            if get_keyword_blocking(porcupine, pa, pixels):
-                command = get_command_blocking(recognizer, pa, pixels)
-
-                logger.info(f"Recognized command: '{command}'.")
-                client.publish(MQTT_INFO_TOPIC, payload=command, qos=1)
-
-                if command == "exit":
-                    logging.info("Exiting app.")
-                    keep_running = False
-                elif command == "set coffee timer" or command == "make coffee":
-                    coffee_timer()
-
-                elif command.startswith("turn computer"):
-                    computer_control(command, client)
-
-                elif socket_control(command, client):
-                    pixels.put(pixels.pattern.cmd_accepted)
-
-                else:
-                    pixels.put(pixels.pattern.cmd_rejected)
+            try:
+                command = commands.get(timeout=1)
+            except Queue.Empty:
+                continue
+            else:
+                keep_running = dispatch(command, client)
 
     except KeyboardInterrupt:
         logging.info("stopping...")
     finally:
+        if capture is not None:
+            capture.close()
+
+        if worker is not None:
+            worker.join(timeout=5)
+
         if porcupine is not None:
             porcupine.delete()
 
         if pa is not None:
             pa.terminate()
 
-        client.loop_stop()
-        client.publish(MQTT_STATUS_TOPIC, payload="offline", qos=0)
-        client.disconnect()
+        # Not buffered, a replay would report offline after the next start
+        client.publish(MQTT_STATUS_TOPIC, payload="offline", buffer=False)
+        client.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from collections import deque
+
+try:
+    import queue as Queue
+except ImportError:
+    import Queue as Queue
+
+logger = logging.getLogger(__name__)
+
+BROKERS = ["localhost", "192.168.1.202", "192.168.1.203"]
+PORT = 8883
+KEEPALIVE = 60
+PROBE_TIMEOUT = 2
+CONNECT_TIMEOUT = 10
+RECONNECT_MIN = 1
+RECONNECT_MAX = 60
+OFFLINE_QUEUE = 1000  # Publishes kept in memory while offline
+SPILL_PATH = os.path.expanduser("~/.cache/terminator/mqtt_spill.jsonl")
+SPILL_MAX_BYTES = 10 * 1024 * 1024
+# paho.mqtt.client return codes
+MQTT_ERR_NO_CONN = 4
+MQTT_ERR_QUEUE_SIZE = 15
+
+
+class OfflineBuffer:
+    """Publishes waiting for the broker, in order and in bounded memory.
+
+    The first size messages are kept in memory. Once that is full, newer
+    messages are appended to the file at path, up to max_bytes, and read
+    back size at a time when the memory is empty. Messages that fit in
+    neither are dropped. The file outlives the process, so messages
+    spilled before a restart are replayed after it. How far it was
+    replayed is kept next to it in path + ".offset", and save() writes
+    the memory ahead of it before exiting.
+    """
+
+    def __init__(self, size=OFFLINE_QUEUE, path=SPILL_PATH, max_bytes=SPILL_MAX_BYTES):
+        self.size = size
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory = deque()
+        self.ends = deque()  # File offsets after the messages read back
+        self.offset = 0  # Bytes of the file already read back
+        self.committed = None  # Bytes of the file already replayed
+        self.spilled = 0  # Messages in the file that were not read back yet
+        self.dropped = 0
+        self.replayed = 0
+        self.replay_rate = None
+        if path and os.path.exists(path):
+            self.offset = self._read_offset()
+            with open(path) as f:
+                f.seek(self.offset)
+                self.spilled = sum(1 for _ in f)
+
+    def __len__(self):
+        return len(self.memory) + self.spilled
+
+    def append(self, message):
+        if not self.spilled and len(self.memory) < self.size:
+            self.memory.append(message)
+            return
+
+        if self.path is None:
+            self.dropped += 1
+            return
+        line = self._line(message)
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size + len(line) > self.max_bytes:
+            self.dropped += 1
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(line)
+        self.spilled += 1
+
+    def peek(self):
+        if not self.memory:
+            self._load()
+        return self.memory[0]
+
+    def popleft(self):
+        if not self.memory:
+            self._load()
+        if len(self.ends) == len(self.memory):
+            self.committed = self.ends.popleft()
+        return self.memory.popleft()
+
+    @staticmethod
+    def _line(message):
+        topic, payload, qos, retain = message
+        if isinstance(payload, bytes):
+            payload = payload.decode(errors="replace")
+        return json.dumps([topic, payload, qos, retain]) + "\n"
+
+    def _read_offset(self):
+        try:
+            with open(self.path + ".offset") as f:
+                offset = int(f.read())
+        except (OSError, ValueError):
+            return 0
+        return offset if offset <= os.path.getsize(self.path) else 0
+
+    def _write_offset(self, offset):
+        self.committed = None
+        try:
+            with open(self.path + ".offset", "w") as f:
+                f.write(str(offset))
+        except OSError:
+            logger.warning(f"Could not save the replay offset of {self.path}.")
+
+    def _remove(self):
+        for path in (self.path, self.path + ".offset"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load(self):
+        """Reads the next size spilled messages back into memory."""
+        if not self.spilled:
+            return
+        try:
+            with open(self.path) as f:
+                f.seek(self.offset)
+                while self.spilled and len(self.memory) < self.size:
+                    line = f.readline()
+                    if not line:
+                        self.spilled = 0
+                        break
+                    self.spilled -= 1
+                    try:
+                        message = tuple(json.loads(line))
+                    except ValueError:
+                        logger.warning(f"Skipping broken message {line!r}.")
+                        continue
+                    self.memory.append(message)
+                    self.ends.append(f.tell())
+                self.offset = f.tell()
+        except FileNotFoundError:
+            logger.warning(f"{self.path} is gone, {self.spilled} messages lost.")
+            self.dropped += self.spilled
+            self.spilled = 0
+        if not self.spilled:
+            # All read back, what is left only lives in memory
+            self.offset = 0
+            self.committed = None
+            self.ends.clear()
+            self._remove()
+
+    def save(self):
+        """Writes the messages in memory ahead of the spilled ones."""
+        if not self.memory:
+            return
+        if self.path is None:
+            logger.warning(f"{len(self.memory)} queued messages lost.")
+            self.dropped += len(self.memory)
+            self.memory.clear()
+            return
+        temp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp, "w") as f:
+                f.writelines(self._line(message) for message in self.memory)
+                if self.spilled:
+                    with open(self.path) as spill:
+                        spill.seek(self.offset)
+                        f.writelines(spill)
+            # Rather replay the old file twice than skip into the new one
+            if os.path.exists(self.path + ".offset"):
+                os.remove(self.path + ".offset")
+            os.replace(temp, self.path)
+        except OSError:
+            logger.exception(f"Could not save {len(self.memory)} queued messages.")
+            self.dropped += len(self.memory)
+        else:
+            self.spilled += len(self.memory)
+            self.offset = 0
+            self.committed = None
+        self.memory.clear()
+        self.ends.clear()
+
+    def replay(self, publish):
+        """Publishes the messages in order until publish returns False."""
+        start = time.monotonic()
+        count = 0
+        while len(self):
+            if not publish(self.peek()):
+                break
+            self.popleft()
+            count += 1
+        if self.committed is not None:
+            self._write_offset(self.committed)
+        if count:
+            self.replayed += count
+            self.replay_rate = count / max(time.monotonic() - start, 1e-6)
+        return count
+
+    def stats(self):
+        return {
+            "depth": len(self),
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "replayed": self.replayed,
+            "replay_rate": self.replay_rate,
+        }
+
+
+class Connection:
+    """Keeps a paho client connected to the first broker that answers.
+
+    Connecting happens in a background thread, so nothing ever waits for
+    the network. All brokers are probed in parallel and the client is
+    connected with connect_async and loop_start to the first one that
+    accepts a TCP connection. When no broker answers or the connection is
+    lost, the probing starts over after an exponential backoff from
+    RECONNECT_MIN to RECONNECT_MAX seconds. Publishes while offline are
+    kept in an OfflineBuffer and sent in order once connected again. To
+    keep paho from buffering all of them in memory, its queue is limited
+    to OFFLINE_QUEUE and the replay continues as messages go out.
+
+    on_connect is called like paho's on_connect after every connect.
+    """
+
+    def __init__(
+        self, client, brokers=BROKERS, port=PORT, on_connect=None, spill_path=SPILL_PATH
+    ):
+        self.client = client
+        self.brokers = brokers
+        self.port = port
+        self.on_connect = on_connect
+        self.host = None
+        # Reentrant, paho may call on_publish from within client.publish
+        self.lock = threading.RLock()
+        self.pending = OfflineBuffer(path=spill_path)
+        self.replaying = False
+        self.connected = threading.Event()
+        self.disconnected = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+        client.max_queued_messages_set(OFFLINE_QUEUE)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Disconnects, stops reconnecting and saves the pending messages."""
+        self.stopped.set()
+        if self.connected.is_set():
+            self.client.disconnect()
+        self.disconnected.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        with self.lock:
+            self.pending.save()
+
+    def probe(self):
+        """Returns the first broker that accepts a TCP connection, or None."""
+        answers = Queue.Queue()
+
+        def try_host(host):
+            try:
+                with socket.create_connection((host, self.port), PROBE_TIMEOUT):
+                    answers.put(host)
+            except OSError:
+                answers.put(None)
+
+        for host in self.brokers:
+            thread = threading.Thread(target=try_host, args=(host,))
+            thread.daemon = True
+            thread.start()
+        for _ in self.brokers:
+            host = answers.get()
+            if host is not None:
+                return host
+        return None
+
+    def _run(self):
+        delay = RECONNECT_MIN
+        while not self.stopped.is_set():
+            host = self.probe()
+            if host is not None and not self.stopped.is_set():
+                logger.debug(f"Connecting to broker {host} on port {self.port}.")
+                self.host = host
+                self.disconnected.clear()
+                self.client.connect_async(host, self.port, KEEPALIVE)
+                self.client.loop_start()
+                if self._wait_connected(CONNECT_TIMEOUT):
+                    delay = RECONNECT_MIN
+                    self.disconnected.wait()
+                elif not self.stopped.is_set():
+                    logger.warning(f"Connecting to broker {host} timed out.")
+                self.client.loop_stop()
+                if self.stopped.is_set():
+                    break
+            else:
+                logger.warning(
+                    "No broker reachable of {}.".format(", ".join(self.brokers))
+                )
+
+            logger.info(f"Reconnecting in {delay}s.")
+            self.stopped.wait(delay)
+            delay = min(2 * delay, RECONNECT_MAX)
+
+    def _wait_connected(self, timeout):
+        """Waits until connected, the timeout passed or stop() was called."""
+        deadline = time.monotonic() + timeout
+        while not self.stopped.is_set() and time.monotonic() < deadline:
+            if self.connected.wait(0.1):
+                return True
+        return False
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.warning(f"Broker {self.host} refused connection ({rc}).")
+            return
+        logger.info(f"Connected to broker on host {self.host}.")
+        if self.on_connect:
+            self.on_connect(client, userdata, flags, rc)
+        with self.lock:
+            self.connected.set()
+            if self.pending:
+                logger.info(f"Sending {len(self.pending)} queued messages.")
+                self._replay()
+
+    def _on_disconnect(self, client, userdata, rc):
+        if rc != 0:
+            logger.warning(f"Lost connection to broker {self.host} ({rc}).")
+        self.connected.clear()
+        self.disconnected.set()
+
+    def _on_publish(self, client, userdata, mid):
+        # Room in paho's queue again, go on with the replay
+        if self.pending and self.connected.is_set():
+            with self.lock:
+                self._replay()
+
+    def _replay(self):
+        if self.replaying:
+            return
+        self.replaying = True
+        try:
+            self.pending.replay(self._send)
+        finally:
+            self.replaying = False
+
+    def _send(self, message):
+        """Hands message to paho, returns False if paho did not take it."""
+        rc = self.client.publish(*message).rc
+        if rc == MQTT_ERR_QUEUE_SIZE:
+            return False
+        if rc == MQTT_ERR_NO_CONN:
+            # paho keeps qos>0 messages and sends them after reconnecting
+            return message[2] > 0
+        if rc != 0:
+            logger.warning(f"Dropping message to {message[0]} ({rc}).")
+            self.pending.dropped += 1
+        return True
+
+    def publish(self, topic, payload=None, qos=0, retain=False, buffer=True):
+        """Publishes now if connected, else queues until connected again.
+
+        With buffer=False the message is only sent if connected, ahead of
+        any queued ones. For states like an online status, which are stale
+        by the time they would be replayed.
+        """
+        message = (topic, payload, qos, retain)
+        with self.lock:
+            if self.connected.is_set() and (not buffer or not self.pending):
+                if self._send(message):
+                    return
+            if buffer:
+                self.pending.append(message)
+            else:
+                logger.debug(f"Not connected, skipping message to {topic}.")
+
+    def stats(self):
+        return dict(self.pending.stats(), connected=self.connected.is_set())
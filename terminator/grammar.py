@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import json
+
+
+class Node(object):
+    def __init__(self):
+        self.children = {}  # token -> (node, slot name or None, slot value)
+        self.intent = None
+
+
+class Grammar(object):
+    """Command table compiled into a token trie.
+
+    The table is a list of (intent, template) pairs. Templates are words
+    and {slot} placeholders, slots maps every slot name to a dict of
+    spoken words and their values. Example:
+
+        Grammar(
+            [("socket", "turn {state} socket {socket}")],
+            {"state": {"on": "on", "off": "off"}, "socket": {"one": 1}},
+        )
+
+    Every slot word gets its own branch, so an utterance is resolved to an
+    intent and its slots in one pass over its words.
+    """
+
+    def __init__(self, table, slots=None):
+        self.slots = slots or {}
+        self.root = Node()
+        self.phrases = []
+        for intent, template in table:
+            self.add(intent, template.split())
+
+    def add(self, intent, template, node=None, words=()):
+        node = node or self.root
+        if not template:
+            if node.intent is not None and node.intent != intent:
+                raise ValueError(f"'{' '.join(words)}' is {node.intent} and {intent}")
+            node.intent = intent
+            self.phrases.append(" ".join(words))
+            return
+
+        token, rest = template[0], template[1:]
+        if token.startswith("{") and token.endswith("}"):
+            slot = token[1:-1]
+            branches = [(word, slot, value) for word, value in self.slots[slot].items()]
+        else:
+            branches = [(token, None, None)]
+
+        for word, slot, value in branches:
+            child, child_slot, child_value = node.children.get(
+                word, (Node(), slot, value)
+            )
+            if (child_slot, child_value) != (slot, value):
+                raise ValueError(f"'{word}' is used with different slots")
+            node.children[word] = (child, slot, value)
+            self.add(intent, rest, child, words + (word,))
+
+    def walk(self, text):
+        """Returns the node text leads to and the slots on the way."""
+        node = self.root
+        slots = {}
+        for word in text.split():
+            try:
+                node, slot, value = node.children[word]
+            except KeyError:
+                return None, slots
+            if slot is not None:
+                slots[slot] = value
+        return node, slots
+
+    def match(self, text):
+        """Returns (intent, slots) for a command, or (None, {})."""
+        node, slots = self.walk(text)
+        if node is None or node.intent is None:
+            return None, {}
+        return node.intent, slots
+
+    def complete(self, text):
+        """Whether text is a command that no other command extends."""
+        node, _ = self.walk(text)
+        return node is not None and node.intent is not None and not node.children
+
+    def vosk_grammar(self):
+        """All phrases as JSON grammar for vosk.KaldiRecognizer."""
+        return json.dumps(self.phrases + ["[unk]"])
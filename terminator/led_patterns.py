@@ -17,10 +17,143 @@
 
 import numpy
 import time
+import threading
+from collections import OrderedDict
+
+
+class Animation(object):
+    """A pattern rendered once into contiguous frames.
+
+    frames is a (frames x pixels x 4) uint8 array in the layout passed to
+    show(), delays holds the seconds each frame stays on and scales the fade
+    level passed along with it. Looping animations restart at frame index
+    loop and run until the pattern is stopped.
+    """
+
+    def __init__(self, frames, delays, scales=None, loop=None):
+        frames = numpy.clip(numpy.asarray(frames), 0, 255)
+        self.frames = numpy.ascontiguousarray(frames, dtype=numpy.uint8)
+        self.delays = numpy.broadcast_to(
+            numpy.asarray(delays, dtype=float), len(self.frames)
+        ).tolist()
+        if scales is None:
+            scales = 1.0
+        self.scales = numpy.broadcast_to(
+            numpy.asarray(scales, dtype=float), len(self.frames)
+        ).tolist()
+        self.loop = loop
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+
+class FrameCache(object):
+    """LRU cache of compiled animations, bounded by the size of their frames."""
+
+    def __init__(self, max_bytes=256 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.animations = OrderedDict()
+
+    def get(self, key, compile):
+        animation = self.animations.get(key)
+        if animation is not None:
+            self.animations.move_to_end(key)
+            return animation
+
+        animation = compile()
+        self.animations[key] = animation
+        self.nbytes += animation.nbytes
+        # Never evict the animation that is about to be played
+        while self.nbytes > self.max_bytes and len(self.animations) > 1:
+            _, evicted = self.animations.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return animation
+
+
+class FrameScheduler(object):
+    """Paces animation frames on monotonic deadlines.
+
+    Every frame gets a slot of its delay, but at least one frame period of
+    the target fps. Deadlines are absolute from start(), so time spent
+    rendering and sending does not add up. A frame whose slot has already
+    passed is dropped instead of shown late. Frames without a delay and the
+    last frame of an animation leave the ring in its end state and are
+    always shown.
+
+    Achieved fps, wakeup jitter and dropped frames are counted over all
+    runs, see stats().
+    """
+
+    def __init__(self, fps=200, clock=time.monotonic, sleep=time.sleep):
+        self.period = 1.0 / fps
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = None
+        self.started = None
+
+        self.frames = 0
+        self.dropped = 0
+        self.run_time = 0.0
+        self.waits = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+
+    def start(self):
+        self.started = self.deadline = self.clock()
+
+    def finish(self):
+        if self.started is not None:
+            self.run_time += self.clock() - self.started
+            self.started = None
+
+    def slot(self, delay):
+        return max(delay, self.period) if delay > 0 else 0.0
+
+    def due(self, delay, last=False):
+        """Returns whether the next frame should be shown or dropped."""
+        slot = self.slot(delay)
+        if slot and not last and self.clock() >= self.deadline + slot:
+            self.dropped += 1
+            return False
+        self.frames += 1
+        return True
+
+    def wait(self, delay, sleep=None):
+        """Sleeps until the end of the current frame slot.
+
+        sleep replaces the default sleep function for this frame. If it
+        returns True the wait was interrupted and no jitter is recorded.
+        """
+        self.deadline += self.slot(delay)
+        remaining = self.deadline - self.clock()
+        if remaining > 0:
+            if (sleep or self.sleep)(remaining):
+                return
+            jitter = abs(self.clock() - self.deadline)
+            self.waits += 1
+            self.jitter_sum += jitter
+            self.jitter_max = max(self.jitter_max, jitter)
+
+    def stats(self):
+        run_time = self.run_time
+        if self.started is not None:
+            run_time += self.clock() - self.started
+        return {
+            "fps": self.frames / run_time if run_time else 0.0,
+            "jitter": self.jitter_sum / self.waits if self.waits else 0.0,
+            "max_jitter": self.jitter_max,
+            "frames": self.frames,
+            "dropped": self.dropped,
+        }
 
 
 class LedPattern(object):
-    def __init__(self, show=None, number=12):
+    def __init__(self, show=None, number=12, cache=None, scheduler=None):
         self.pixels_number = number
         self.pixels = [0] * 4 * number
 
@@ -35,195 +168,240 @@ class LedPattern(object):
 
         if not show or not callable(show):
 
-            def dummy(data):
+            def dummy(data, scale=1.0):
                 pass
 
             show = dummy
 
         self.show = show
-        self.stop = False
+        self.stop_event = threading.Event()
+        # Stop all animations on stop, not just looping ones
+        self.interrupt = False
+        self.cache = cache if cache is not None else FrameCache()
+        self.scheduler = scheduler if scheduler is not None else FrameScheduler()
+
+    @property
+    def stop(self):
+        return self.stop_event.is_set()
+
+    @stop.setter
+    def stop(self, stop):
+        if stop:
+            self.stop_event.set()
+        else:
+            self.stop_event.clear()
+
+    def _frames(self, *pixels):
+        return numpy.array(pixels).reshape(len(pixels), -1, 4)
+
+    def _play(self, key, compile):
+        """Plays the cached animation for key, compiling it on first use.
+
+        Returns the number of frames played, including dropped ones.
+        Looping animations check for stop before every frame, all others
+        always run to the end unless interrupt is set. Frames are paced by
+        the scheduler; interruptible animations wait on stop_event, so
+        they end within one frame even in the middle of a long delay.
+        """
+        animation = self.cache.get(key, compile)
+        interruptible = self.interrupt or animation.loop is not None
+        sleep = self.stop_event.wait if interruptible else None
+        index = 0
+        played = 0
+        self.scheduler.start()
+        try:
+            while index < len(animation):
+                if interruptible and self.stop:
+                    break
+                delay = animation.delays[index]
+                last = index == len(animation) - 1 and animation.loop is None
+                if self.scheduler.due(delay, last):
+                    self.show(animation.frames[index], animation.scales[index])
+                self.scheduler.wait(delay, sleep)
+                played += 1
+                index += 1
+                if index == len(animation) and animation.loop is not None:
+                    index = animation.loop
+        finally:
+            self.scheduler.finish()
+        return played
 
     def cmd_accepted(self):
+        self._play("cmd_accepted", self._compile_cmd_accepted)
+
+    def _compile_cmd_accepted(self):
         pixels = [255, 0, 0, 0] * self.pixels_number
         pixels += [0, 2, 50, 0] * 5
         pixels += [255, 0, 0, 0] * self.pixels_number
 
-        for i in reversed(range(18)):
-            active_pixels = pixels[i * 4 : (12 + i) * 4]
-            self.show(active_pixels)
-            time.sleep(0.05)
+        frames = [
+            pixels[i * 4 : (self.pixels_number + i) * 4] for i in reversed(range(18))
+        ]
+        return Animation(self._frames(*frames), 0.05)
 
     def cmd_rejected(self):
-        pixels = numpy.array([0, 1, 0, 0] * 12)
-        self.show(pixels)
-        time.sleep(0.1)
+        self._play("cmd_rejected", self._compile_cmd_rejected)
+
+    def _compile_cmd_rejected(self):
+        pixels = numpy.array([0, 1, 0, 0] * self.pixels_number)
+        frames = [pixels]
+        delays = [0.1]
         for i in range(15):
             if i < 7:
-                pixels *= 2
+                pixels = pixels * 2
             else:
                 pixels = pixels / 2
-            self.show(pixels)
-            time.sleep(0.05)
-        self.off()
+            frames.append(pixels)
+            delays.append(0.05)
+        frames.append([0] * 4 * self.pixels_number)
+        delays.append(0)
+        return Animation(self._frames(*frames), delays)
 
     def alexa_wakeup(self, direction=0):
         position = (
             int((direction + 15) / (360 / self.pixels_number)) % self.pixels_number
         )
 
-        pixels = [0, 0, 0, 24] * self.pixels_number
-        pixels[position * 4 + 2] = 48
+        def compile():
+            pixels = [0, 0, 0, 24] * self.pixels_number
+            pixels[position * 4 + 2] = 48
+            return Animation(self._frames(pixels), 0)
 
-        self.show(pixels)
+        self._play(("alexa_wakeup", position), compile)
 
     def google_wakeup(self, direction=0):
         position = int((direction + 15) / 30) % 12
 
-        basis = numpy.roll(self.basis, position * 4)
-        for i in range(1, 25):
-            pixels = basis * i
-            self.show(pixels)
-            time.sleep(0.005)
+        def compile():
+            basis = numpy.roll(self.basis, position * 4)
+            frames = [basis * i for i in range(1, 25)]
+            delays = [0.005] * 24
 
-        pixels = numpy.roll(pixels, 4)
-        self.show(pixels)
-        time.sleep(0.1)
+            pixels = numpy.roll(frames[-1], 4)
+            frames.append(pixels)
+            delays.append(0.1)
 
-        for i in range(2):
-            new_pixels = numpy.roll(pixels, 4)
-            self.show(new_pixels * 0.5 + pixels)
-            pixels = new_pixels
-            time.sleep(0.1)
+            for i in range(2):
+                new_pixels = numpy.roll(pixels, 4)
+                frames.append(new_pixels * 0.5 + pixels)
+                delays.append(0.1)
+                pixels = new_pixels
 
-        self.show(pixels)
-        self.pixels_np_google = pixels
+            frames.append(pixels)
+            delays.append(0)
+            return Animation(self._frames(*frames), delays)
+
+        self._play(("google_wakeup", position), compile)
+        self.pixels_np_google = numpy.roll(self.basis, position * 4 + 12) * 24
 
     def alexa_listen(self):
-        pixels = [0, 0, 0, 24] * self.pixels_number
+        def compile():
+            return Animation(self._frames([0, 0, 0, 24] * self.pixels_number), 0)
 
-        self.show(pixels)
+        self._play("alexa_listen", compile)
 
     def google_listen(self):
         pixels = self.pixels_np_google
-        for i in range(1, 25):
-            self.show(pixels * i / 24)
-            time.sleep(0.01)
+
+        def compile():
+            frames = self._frames(*[pixels] * 24)
+            return Animation(frames, 0.01, [i / 24 for i in range(1, 25)])
+
+        self._play(("google_listen", pixels.tobytes()), compile)
 
     def alexa_think(self):
-        pixels = [0, 0, 12, 12, 0, 0, 0, 24] * self.pixels_number
+        def compile():
+            pixels = [0, 0, 12, 12, 0, 0, 0, 24] * self.pixels_number
+            frames = [pixels, pixels[-4:] + pixels[:-4]]
+            frames = [frame[: 4 * self.pixels_number] for frame in frames]
+            return Animation(self._frames(*frames), 0.2, loop=0)
 
-        while not self.stop:
-            self.show(pixels)
-            time.sleep(0.2)
-            pixels = pixels[-4:] + pixels[:-4]
+        self._play("alexa_think", compile)
 
     def google_think(self):
         pixels = self.pixels_np_google
 
-        while not self.stop:
-            pixels = numpy.roll(pixels, 4)
-            self.show(pixels)
-            time.sleep(0.2)
+        def compile():
+            frames = [numpy.roll(pixels, 4 * (i + 1)) for i in range(12)]
+            return Animation(self._frames(*frames), 0.2, loop=0)
+
+        played = self._play(("google_think", pixels.tobytes()), compile)
+        pixels = numpy.roll(pixels, 4 * (played % 12))
 
-        t = 0.1
-        for i in range(0, 5):
-            pixels = numpy.roll(pixels, 4)
-            self.show(pixels * (4 - i) / 4)
-            time.sleep(t)
-            t /= 2
+        def compile_fade():
+            frames = [numpy.roll(pixels, 4 * (i + 1)) for i in range(5)]
+            delays = [0.1 / 2**i for i in range(5)]
+            scales = [(4 - i) / 4 for i in range(5)]
+            return Animation(self._frames(*frames), delays, scales)
 
-        self.pixels_np_google = pixels
+        self._play(("google_think_fade", pixels.tobytes()), compile_fade)
+        self.pixels_np_google = numpy.roll(pixels, 4 * 5)
 
     def alexa_speak(self):
-        step = 1
-        position = 12
-        while not self.stop:
-            pixels = [0, 0, position, 24 - position] * self.pixels_number
-            self.show(pixels)
-            time.sleep(0.01)
-            if position <= 0:
-                step = 1
-                time.sleep(0.4)
-            elif position >= 12:
-                step = -1
-                time.sleep(0.4)
-
-            position += step
+        self._play("alexa_speak", self._compile_alexa_speak)
+
+    def _compile_alexa_speak(self):
+        # Down from 12 to 0 and back up, pausing at both ends
+        positions = list(range(12, -1, -1)) + list(range(1, 12))
+        frames = [
+            [0, 0, position, 24 - position] * self.pixels_number
+            for position in positions
+        ]
+        delays = [0.41 if position in (0, 12) else 0.01 for position in positions]
+        return Animation(self._frames(*frames), delays, loop=0)
 
     def google_speak(self):
         pixels = self.pixels_np_google
-        step = 1
-        brightness = 10
-        while not self.stop:
-            self.show(pixels * brightness / 24)
-            time.sleep(0.02)
 
-            if brightness <= 5:
-                step = 1
-                time.sleep(0.4)
-            elif brightness >= 24:
-                step = -1
-                time.sleep(0.4)
+        def compile():
+            # Fade up from 10 once, then between 24 and 5, pausing at both ends
+            brightness = list(range(10, 24))
+            brightness += list(range(24, 4, -1)) + list(range(6, 24))
+            frames = self._frames(*[pixels] * len(brightness))
+            delays = [0.42 if b in (5, 24) else 0.02 for b in brightness]
+            scales = [b / 24 for b in brightness]
+            return Animation(frames, delays, scales, loop=14)
 
-            brightness += step
+        self._play(("google_speak", pixels.tobytes()), compile)
 
     def alarm(self):
-        step = 1
-        position = 1
-        start = True
-
-        while not self.stop:
-            pixels = [0, position, 0, 0] * self.pixels_number
-
-            self.show(pixels)
-            time.sleep(0.02)
+        self._play("alarm", self._compile_alarm)
 
-            if position > 20:
-                start = False
-                step = -1
-            elif position < 1:
-                step = 1
-
-            position += step
+    def _compile_alarm(self):
+        positions = list(range(1, 22)) + list(range(20, -1, -1))
+        frames = [[0, position, 0, 0] * self.pixels_number for position in positions]
+        return Animation(self._frames(*frames), 0.02, loop=0)
 
     def wait(self):
-        position = 0
-        step = True
-
-        while not self.stop:
-            pixels = []
-            for i in range(self.pixels_number):
-                if i == position and step:
-                    pixels += [0, 15, 15, 0]
-                else:
-                    pixels += [0] * 4
-
-            self.show(pixels)
-            time.sleep(0.5)
-
-            if position > 11:
-                position = 0
+        self._play("wait", self._compile_wait)
 
-            if step:
-                position += 1
-            step = not step
+    def _compile_wait(self):
+        # Every pixel lights up in turn, with a dark frame in between
+        frames = []
+        for position in range(self.pixels_number):
+            pixels = [0] * 4 * self.pixels_number
+            pixels[position * 4 : position * 4 + 4] = [0, 15, 15, 0]
+            frames += [pixels, [0] * 4 * self.pixels_number]
+        return Animation(self._frames(*frames), 0.5, loop=0)
 
     def timer(self, seconds=15):
-        position = 0
-        step = seconds / self.pixels_number
-
-        while not self.stop:
-            pixels = []
-            for i in range(self.pixels_number):
-                if i <= position:
-                    pixels += [0, 5, 5, 5]
-                else:
-                    pixels += [0] * 4
-
-            self.show(pixels)
-            time.sleep(step)
-
-            position += 1
+        def compile():
+            frames = []
+            for position in range(self.pixels_number):
+                pixels = []
+                for i in range(self.pixels_number):
+                    if i <= position:
+                        pixels += [0, 5, 5, 5]
+                    else:
+                        pixels += [0] * 4
+                frames.append(pixels)
+            step = seconds / self.pixels_number
+            return Animation(self._frames(*frames), step, loop=self.pixels_number - 1)
+
+        self._play(("timer", seconds), compile)
 
     def off(self):
-        self.show([0] * 4 * 12)
+        def compile():
+            return Animation(self._frames([0] * 4 * self.pixels_number), 0)
+
+        self._play("off", compile)
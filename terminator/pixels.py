@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import apa102
+import numpy
 import time
 import threading
 from gpiozero import LED
@@ -15,17 +16,36 @@ from led_patterns import LedPattern
 
 
 class Pixels:
+    """Runs LED patterns on the ring in a worker thread.
+
+    By default every queued pattern is played in order. With latest_wins,
+    pending patterns are coalesced so only the newest one runs, and the
+    running pattern is interrupted within one frame.
+    """
+
     PIXELS_N = 12
+    FADE_GAMMA = 2.2  # Makes pattern fades look linear to the eye
 
-    def __init__(self, pattern=LedPattern):
+    def __init__(self, pattern=LedPattern, latest_wins=False):
+        self.latest_wins = latest_wins
         self.pattern = pattern(show=self.show)
 
-        self.dev = apa102.APA102(num_led=self.PIXELS_N)
+        self.dev = apa102.APA102(num_led=self.PIXELS_N, fade_gamma=self.FADE_GAMMA)
 
         self.power = LED(5)
         self.power.on()
 
         self.queue = Queue.Queue()
+        # Held while setting stop and queueing, and while clearing stop and
+        # draining, so a put racing the worker can't lose its stop
+        self.lock = threading.Lock()
+        # State change to first frame on the wire latency, in seconds
+        self.pending_since = None
+        self.latency_last = None
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_count = 0
+        self.coalesced = 0
         self.thread = threading.Thread(target=self._run)
         self.thread.daemon = True
         self.thread.start()
@@ -78,38 +98,73 @@ class Pixels:
         self.put(self.pattern.off)
 
     def put(self, func):
-        self.pattern.stop = True
-        self.queue.put(func)
+        with self.lock:
+            self.pattern.stop = True
+            self.queue.put((func, time.monotonic()))
 
     def _run(self):
         while True:
-            func = self.queue.get()
-            self.pattern.stop = False
+            func, since = self.queue.get()
+            with self.lock:
+                self.pattern.stop = False
+                if self.latest_wins:
+                    while True:
+                        try:
+                            func, since = self.queue.get_nowait()
+                        except Queue.Empty:
+                            break
+                        self.coalesced += 1
+                elif not self.queue.empty():
+                    # Don't let a looping pattern block the ones queued after it
+                    self.pattern.stop = True
+            self.pending_since = since
+            # Set here, the pattern may have been replaced since __init__
+            self.pattern.interrupt = self.latest_wins
             func()
 
-    def show(self, data):
-        for i in range(self.PIXELS_N):
-            self.dev.set_pixel(
-                i, int(data[4 * i + 1]), int(data[4 * i + 2]), int(data[4 * i + 3])
-            )
-
+    def show(self, data, scale=1.0):
+        # LedPattern data is 4 values per pixel, the first one is unused
+        self.dev.set_pixels(numpy.asarray(data).reshape(-1, 4)[:, 1:], scale=scale)
         self.dev.show()
 
+        if self.pending_since is not None:
+            self.latency_last = time.monotonic() - self.pending_since
+            self.pending_since = None
+            self.latency_sum += self.latency_last
+            self.latency_max = max(self.latency_max, self.latency_last)
+            self.latency_count += 1
+
+    def stats(self):
+        return {
+            "latency": self.latency_last,
+            "mean_latency": (
+                self.latency_sum / self.latency_count if self.latency_count else None
+            ),
+            "max_latency": self.latency_max,
+            "coalesced": self.coalesced,
+        }
+
 
 if __name__ == "__main__":
     start = time.time()
     methods = [
         func
         for func in dir(LedPattern)
-        if callable(getattr(LedPattern, func)) and "__" not in func
+        if callable(getattr(LedPattern, func)) and not func.startswith("_")
     ]
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", choices=methods)
     parser.add_argument("-t", type=int)
+    parser.add_argument(
+        "-l",
+        "--latest-wins",
+        action="store_true",
+        help="Only play the newest pattern and interrupt the running one.",
+    )
     args = parser.parse_args()
 
-    pixels = Pixels()
+    pixels = Pixels(latest_wins=args.latest_wins)
 
     if args.t:
         t = args.t
@@ -154,3 +209,5 @@ if __name__ == "__main__":
         pixels.off()
         time.sleep(1)
     print(time.time() - start)
+    print(pixels.pattern.scheduler.stats())
+    print(pixels.stats())